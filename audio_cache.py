@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+
+# A cache of decoded audio for the local engines.  Each file is decoded once to
+# 16 kHz mono PCM and stored as a .npy file keyed by the hash of the source
+# audio, so comparing engines or models on the same episode, or re-running
+# after a failure, doesn't need to run ffmpeg again.
+
+from hashlib import sha256
+import contextlib
+import os
+import subprocess
+import tempfile
+
+SAMPLE_RATE = 16000
+
+# Where to store the cache, and how big to let it get before removing the
+# least recently used entries
+CACHE_DIR = os.environ.get("PODCAST_AUDIO_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "podcast_to_text", "audio"))
+CACHE_LIMIT = int(os.environ.get("PODCAST_AUDIO_CACHE_MB", "4096")) * 1048576
+
+# Temp files that are kept out of the cache, since they won't be seen again,
+# along with their audio if the caller has already decoded it
+_g_uncached = {}
+
+@contextlib.contextmanager
+def uncached(fn, audio=None):
+    # While this is active, load_audio returns the given int16 audio for fn,
+    # or decodes it without storing it in the cache if there isn't any
+    key = os.path.abspath(fn)
+    _g_uncached[key] = audio
+    try:
+        yield
+    finally:
+        del _g_uncached[key]
+
+def hash_file(fn):
+    ret = sha256()
+    with open(fn, "rb") as f:
+        while True:
+            temp = f.read(1048576)
+            if len(temp) == 0:
+                break
+            ret.update(temp)
+    return ret.hexdigest()
+
+def get_cache_fn(key):
+    return os.path.join(CACHE_DIR, f"{key}_int16.npy")
+
+def decode(source_fn, dest_fn, ffmpeg="ffmpeg"):
+    # Decode a file to int16 samples in a .npy file
+    import numpy as np
+
+    # This matches the command line Whisper uses to load audio
+    cmd = [
+        ffmpeg,
+        "-nostdin",
+        "-threads", "0",
+        "-i", source_fn,
+        "-f", "s16le",
+        "-ac", "1",
+        "-acodec", "pcm_s16le",
+        "-ar", str(SAMPLE_RATE),
+        "-",
+    ]
+    print("Decoding audio...")
+    # Other processes can be decoding the same file, so each gets its own
+    # temp files, and only the final rename is shared
+    f, raw_fn = tempfile.mkstemp(".raw", dir=os.path.dirname(os.path.abspath(dest_fn)))
+    os.close(f)
+    f, temp_fn = tempfile.mkstemp(".tmp.npy", dir=os.path.dirname(os.path.abspath(dest_fn)))
+    os.close(f)
+    try:
+        # Stream the decoded audio to disk, so we never need to hold a full
+        # copy of it in memory
+        with open(raw_fn, "wb") as f:
+            subprocess.run(cmd, stdout=f, stderr=subprocess.DEVNULL, check=True)
+
+        samples = os.path.getsize(raw_fn) // 2
+        dest = np.lib.format.open_memmap(temp_fn, mode="w+", dtype=np.int16, shape=(samples,))
+        if samples > 0:
+            raw = np.memmap(raw_fn, dtype=np.int16, mode="r", shape=(samples,))
+            step = 16777216
+            for i in range(0, samples, step):
+                dest[i:i+step] = raw[i:i+step]
+            del raw
+        dest.flush()
+        del dest
+        # Only move it into place once it's complete so other processes
+        # never see a partial file
+        os.replace(temp_fn, dest_fn)
+    finally:
+        for cur in [raw_fn, temp_fn]:
+            if os.path.isfile(cur):
+                os.unlink(cur)
+
+def evict(keep=None):
+    # Remove the least recently used entries till the cache fits in the limit
+    entries = []
+    for cur in os.listdir(CACHE_DIR):
+        # Leave files that are still being decoded alone
+        if cur.endswith(".npy") and not cur.endswith(".tmp.npy"):
+            fn = os.path.join(CACHE_DIR, cur)
+            stat = os.stat(fn)
+            entries.append((stat.st_mtime, stat.st_size, fn))
+    entries.sort()
+
+    total = sum(x[1] for x in entries)
+    for _, size, fn in entries:
+        if total <= CACHE_LIMIT:
+            break
+        if fn == keep:
+            continue
+        try:
+            os.unlink(fn)
+            total -= size
+        except OSError:
+            # Probably in use by another process
+            pass
+
+def load_audio(source_fn, dtype="float32", ffmpeg="ffmpeg"):
+    # Load the decoded audio for a file, as float32 samples in -1 to 1 (what
+    # Whisper and friends expect) or int16 samples.  Only int16 samples are
+    # cached, so every engine shares one decode, and they're returned as a
+    # copy-on-write memory map of the cache, so nothing is copied unless the
+    # caller writes to it.  float32 samples are converted from them in memory.
+    import numpy as np
+
+    if dtype not in {"float32", "int16"}:
+        raise Exception(f"Unsupported audio type {dtype}")
+
+    key = os.path.abspath(source_fn)
+    if key in _g_uncached:
+        audio = _g_uncached[key]
+        if audio is None:
+            # Decode to a temp file and load it from there, it's not worth keeping
+            f, temp_fn = tempfile.mkstemp(".npy")
+            os.close(f)
+            try:
+                decode(source_fn, temp_fn, ffmpeg)
+                audio = np.load(temp_fn)
+            finally:
+                os.unlink(temp_fn)
+    else:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        fn = get_cache_fn(hash_file(source_fn))
+        if os.path.isfile(fn):
+            # Mark it as recently used
+            os.utime(fn)
+        else:
+            decode(source_fn, fn, ffmpeg)
+            evict(keep=fn)
+        audio = np.load(fn, mmap_mode="c")
+
+    if dtype == "float32":
+        return audio.astype(np.float32) / 32768.0
+    return audio
+
+def write_wav(audio, dest_fn):
+    # Write out int16 samples to a wav file for tools that need a file
+    import wave
+
+    with wave.open(dest_fn, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(SAMPLE_RATE)
+        step = 16777216
+        for i in range(0, len(audio), step):
+            f.writeframes(audio[i:i+step].tobytes())
+
+if __name__ == "__main__":
+    print("This module is not meant to be run directly.")
@@ -0,0 +1,784 @@
+#!/usr/bin/env python3
+
+# Benchmarks for the slower parts of the pipeline, using transcripts from the
+# null engine so they can run without any real audio or engines installed
+
+from command_opts import opt, main_entry
+from decimal import Decimal
+from engines import null
+import base64
+import contextlib
+import gzip
+import io
+import json
+import os
+import random
+import re
+import shutil
+import subprocess
+import tempfile
+import templater
+import time
+import tracemalloc
+
+class BruteParagraph(templater.IsParagraph):
+    # The original gap check, scanning every pair of gaps in the window, to
+    # compare the rolling median against
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.brute = []
+
+    def check(self, word, start, end):
+        self.was_sentence = False
+        self.was_paragraph = False
+        if self.last_sentence:
+            self.was_sentence = True
+            dur = min(start, end) - self.last_end
+            self.brute.append(dur)
+            if len(self.brute) > self.window:
+                self.brute.pop(0)
+            best = min((sum(abs(x - y) for x in self.brute), y) for y in self.brute)[1]
+            best = max(best, self.min_gap)
+            if dur > best:
+                if self.ticks:
+                    self.was_paragraph = (dur - best) > best * 2
+                else:
+                    self.was_paragraph = ((dur - best) / best) > 2
+        self.last_end = max(start, end)
+        self.last_sentence = (len(word) > 0 and word[-1] in "\\),:;.?!'\"")
+
+def make_words(words, phrases=False, seed=1, speakers=2):
+    # Create a transcript with about the given number of words, along with a
+    # short silent MP3 to go with it, so rendering doesn't spend its time
+    # reading the MP3
+    f, mp3_fn = tempfile.mkstemp(".mp3")
+    os.close(f)
+    null.create_silent_mp3(mp3_fn, words / 2.5 * 1.5)
+    settings = {
+        "seed": str(seed),
+        "max_words": str(words),
+        "speakers": str(speakers),
+        "phrases": "yes" if phrases else "no",
+    }
+    data = null.parse_data(null.run_engine(settings, mp3_fn))
+    null.create_silent_mp3(mp3_fn, 10)
+    return data, mp3_fn
+
+def get_words_var(page):
+    # Pull the word data out of a rendered page, the gzip header has a
+    # timestamp, so compare the decoded data instead of the raw page
+    m = re.search(r'"(H4sI[^"]*)"', page)
+    value = json.loads(gzip.decompress(base64.b64decode(m.group(1))))
+    return page.replace(m.group(1), ""), value
+
+def time_it(func, runs):
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        ret = func()
+        took = time.perf_counter() - start
+        if best is None or took < best:
+            best = took
+    return best, ret
+
+@opt("Time rendering a long transcript with and without the integer fast path")
+def render(words=40000, runs=3):
+    for phrases in [False, True]:
+        data, mp3_fn = make_words(words, phrases=phrases)
+        try:
+            slow, slow_page = time_it(lambda: templater.fill_out(data, mp3_fn, use_ticks=False), runs)
+            fast, fast_page = time_it(lambda: templater.fill_out(data, mp3_fn), runs)
+        finally:
+            os.unlink(mp3_fn)
+        ticks = None not in templater.iter_ticks(data, phrases)
+        print(f"{len(data):,} {'phrases' if phrases else 'words'}: Decimal {slow:.3f}s, fast path {fast:.3f}s "
+            f"({slow / fast:.2f}x), used ticks: {ticks}, identical: {get_words_var(slow_page) == get_words_var(fast_page)}")
+
+@opt("Check the fast render path matches the Decimal path for a range of seeds")
+def check_render(seeds=20, words=5000):
+    bad = 0
+    for seed in range(seeds):
+        for phrases in [False, True]:
+            data, mp3_fn = make_words(words, phrases=phrases, seed=seed, speakers=seed % 4)
+            try:
+                slow = get_words_var(templater.fill_out(data, mp3_fn, use_ticks=False))
+                fast = get_words_var(templater.fill_out(data, mp3_fn))
+            finally:
+                os.unlink(mp3_fn)
+            if slow != fast:
+                print(f"Mismatch for seed {seed}, phrases: {phrases}")
+                bad += 1
+    print(f"Checked {seeds * 2:,} transcripts, {bad:,} mismatches")
+
+@opt("Time filling in the template, reading and substituting it each time vs compiled once")
+def template(pages=500):
+    to_replace = {tag: "value" for tag in templater.TEMPLATE_TAGS}
+
+    def substitute():
+        # What fill_out used to do for each page
+        with open("template.html", "rt") as f:
+            data = f.read()
+        all_tags = "(?P<tag>" + "|".join(re.escape(k) for k in to_replace) + ")"
+        data = re.sub(all_tags, lambda m: to_replace[m.group('tag')], data)
+        return "".join(x.strip() for x in data.split("\n"))
+
+    def compiled():
+        output = io.StringIO()
+        templater.render_template(templater.load_template()[0], to_replace, output)
+        return output.getvalue()
+
+    if substitute() != compiled():
+        raise Exception("Compiled template doesn't match")
+
+    for name, func in [("Substitute", substitute), ("Compiled", compiled)]:
+        start = time.perf_counter()
+        for _ in range(pages):
+            func()
+        took = time.perf_counter() - start
+        print(f"{name}: {took / pages * 1000:.3f}ms per page")
+
+@opt("Compare the size of pages with different render options")
+def page_size(words=40000, episodes=2000):
+    data, mp3_fn = make_words(words)
+    modes = [
+        ("Inline", {}),
+        ("External assets", {"assets": "external"}),
+        ("External assets, sidecar words", {"assets": "external", "words": "sidecar"}),
+    ]
+    _, assets = templater.load_template("template.html", "external")
+    shared = [value.encode("utf-8") for _, value in assets]
+    try:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            for name, render in modes:
+                page_fn = os.path.join(temp_dir, "page.html")
+                with open(page_fn, "wt", newline="") as f:
+                    other_files = templater.fill_out(data, mp3_fn, output=f, render=render, page_fn=page_fn)
+                per_page = []
+                for fn in [page_fn] + other_files:
+                    with open(fn, "rb") as f:
+                        per_page.append(f.read())
+                    os.unlink(fn)
+
+                # Files already compressed are served as is
+                gz = lambda x: len(x) if x[:2] == b'\x1f\x8b' else len(gzip.compress(x))
+                page, page_gz = len(per_page[0]), gz(per_page[0])
+                extra, extra_gz = sum(len(x) for x in per_page[1:]), sum(gz(x) for x in per_page[1:])
+                total, total_gz = page + extra, page_gz + extra_gz
+                if render.get("assets") == "external":
+                    total, total_gz = total * episodes + sum(len(x) for x in shared), total_gz * episodes + sum(gz(x) for x in shared)
+                else:
+                    total, total_gz = total * episodes, total_gz * episodes
+                print(f"{name}: page {page:,} bytes ({page_gz:,} gzipped), other files per page {extra:,} bytes ({extra_gz:,} gzipped)")
+                print(f"  {episodes:,} episodes: {total:,} bytes ({total_gz:,} gzipped)")
+    finally:
+        os.unlink(mp3_fn)
+
+# Run the page's own decoder on a payload, timing it
+NODE_DECODE = """
+import fs from 'fs';
+const [template, payload, runs] = process.argv.slice(2);
+const source = fs.readFileSync(template, 'utf8');
+(0, eval)(source.slice(source.indexOf('function decodeCompact'), source.indexOf('function scrollDetected')));
+const value = fs.readFileSync(payload, 'utf8');
+let best = null, words = null;
+for (let i = 0; i < Number(runs); i++) {
+    const start = performance.now();
+    words = await decodeData(value);
+    const took = performance.now() - start;
+    best = (best === null || took < best) ? took : best;
+}
+console.log(JSON.stringify({ms: best, words: words}));
+"""
+
+@opt("Compare the size and decode time of the word data encodings")
+def word_encoding(words=40000, runs=10):
+    data, mp3_fn = make_words(words)
+    try:
+        pages = {x: templater.fill_out(data, mp3_fn, render={"encoding": x}) for x in ["json", "compact"]}
+    finally:
+        os.unlink(mp3_fn)
+
+    decoded = {}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        script_fn = os.path.join(temp_dir, "decode.mjs")
+        with open(script_fn, "wt") as f:
+            f.write(NODE_DECODE)
+        for encoding, page in pages.items():
+            value = json.loads(re.search(r'words:("[^"]*")', page).group(1))
+            size = len(base64.b64decode(value))
+            msg = f"{encoding}: {size:,} bytes compressed, {len(value):,} as base64"
+            if shutil.which("node") is not None:
+                payload_fn = os.path.join(temp_dir, "payload.txt")
+                with open(payload_fn, "wt") as f:
+                    f.write(value)
+                result = subprocess.run(["node", script_fn, "template.html", payload_fn, str(runs)], stdout=subprocess.PIPE, check=True)
+                result = json.loads(result.stdout)
+                decoded[encoding] = result["words"]
+                msg += f", decoded in {result['ms']:.1f}ms"
+            print(msg)
+
+    if len(decoded) == 2:
+        print(f"Both decode to the same data: {decoded['json'] == decoded['compact']}")
+
+# Load a page's player with a bare bones stand in for the DOM, timing the
+# script until the transcript is set up, and counting the elements it makes.
+# There's no layout here, so this is only the script's share of the time a
+# browser takes to make the page interactive.
+NODE_PLAYER = """
+import fs from 'fs';
+const [pageFn, runs] = process.argv.slice(2);
+const page = fs.readFileSync(pageFn, 'utf8');
+const at = page.indexOf('const meta=');
+const script = page.slice(page.lastIndexOf('<script>', at) + 8, page.indexOf('</script>', at))
+    .replace('const extraSetup=()=>{};', 'const extraSetup=()=>{done();};');
+
+let created = 0;
+class Elem {
+    constructor(tag) {
+        this.tagName = tag; this.childNodes = []; this.text = ''; this.className = '';
+        this.style = {setProperty() {}}; this.parentNode = null; created++;
+    }
+    get children() { return this.childNodes; }
+    appendChild(x) { this.childNodes.push(x); x.parentNode = this; return x; }
+    append(...x) { x.forEach(y => this.appendChild(y)); }
+    replaceChildren(...x) { this.childNodes = []; this.append(...x); }
+    get textContent() { return this.childNodes.length ? this.childNodes.map(x => x.textContent).join('') : this.text; }
+    set textContent(value) { this.childNodes = []; this.text = value; }
+    addEventListener() {}
+    getBoundingClientRect() { return {top: 0, bottom: 0, left: 0, right: 0, width: 0, height: 0}; }
+    scrollIntoView() {}
+}
+class Observer { constructor() {} observe() {} unobserve() {} }
+
+let best = null, elements = 0;
+for (let run = 0; run < Number(runs); run++) {
+    const ids = {}, handlers = {};
+    const document = {
+        addEventListener(name, func) { handlers[name] = func; },
+        getElementById(id) { return ids[id] || (ids[id] = new Elem('div')); },
+        querySelector() { return new Elem('div'); },
+        createElement(tag) { return new Elem(tag); },
+        createTextNode(value) { created++; return {textContent: value}; },
+        getSelection() { return {rangeCount: 0}; },
+    };
+    const window = {
+        location: {href: 'http://localhost/page.html', search: '', hash: ''},
+        history: {replaceState() {}}, innerHeight: 800, addEventListener() {},
+        IntersectionObserver: Observer,
+    };
+    const storage = {getItem() { return null; }, setItem() {}};
+    window.localStorage = storage;
+    const finished = new Promise(resolve => {
+        /* The page uses a couple of elements by their IDs as globals */
+        new Function('document', 'window', 'navigator', 'localStorage', 'IntersectionObserver', 'getComputedStyle', 'pos', 'picker', 'done', script)(
+            document, window, {}, storage, Observer, () => ({fontSize: '16px'}), document.getElementById('pos'), document.getElementById('picker'), resolve);
+    });
+    created = 0;
+    const start = performance.now();
+    handlers['DOMContentLoaded']({});
+    await finished;
+    const took = performance.now() - start;
+    best = (best === null || took < best) ? took : best;
+    elements = created;
+}
+console.log(JSON.stringify({ms: best, elements: elements}));
+"""
+
+@opt("Time loading the player for a long transcript, without a browser")
+def player_load(words=50000, runs=5, template_fn="template.html"):
+    if shutil.which("node") is None:
+        raise Exception("This benchmark needs node")
+    data, mp3_fn = make_words(words)
+    try:
+        page = templater.fill_out(data, mp3_fn, template_fn=template_fn)
+    finally:
+        os.unlink(mp3_fn)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        script_fn = os.path.join(temp_dir, "player.mjs")
+        with open(script_fn, "wt") as f:
+            f.write(NODE_PLAYER)
+        page_fn = os.path.join(temp_dir, "page.html")
+        with open(page_fn, "wt") as f:
+            f.write(page)
+        result = subprocess.run(["node", script_fn, page_fn, str(runs)], stdout=subprocess.PIPE, check=True)
+        result = json.loads(result.stdout)
+    print(f"{len(data):,} words: interactive after {result['ms']:.1f}ms of script, {result['elements']:,} elements and text nodes created")
+
+@opt("Measure the peak memory used to render transcripts as they get longer")
+def memory(words=20000, steps=4):
+    templater.load_template()
+    for step in range(steps):
+        data, mp3_fn = make_words(words * 2 ** step)
+        count = len(data)
+        try:
+            with tempfile.TemporaryDirectory() as temp_dir:
+                transcript_fn = os.path.join(temp_dir, "page.mp3.json.gz")
+                with gzip.open(transcript_fn, "wt", newline="", encoding="utf-8") as f:
+                    json.dump(data, f, separators=(',', ':'))
+                del data
+
+                def load():
+                    with gzip.open(transcript_fn, "rb") as f:
+                        return json.load(f)
+                page_fn = os.path.join(temp_dir, "page.html")
+                results = []
+                for name, get_words in [("loaded", load), ("streamed", lambda: templater.StreamTranscript(transcript_fn))]:
+                    start = time.perf_counter()
+                    tracemalloc.start()
+                    with open(page_fn, "wt", newline="") as f:
+                        templater.fill_out(get_words(), mp3_fn, output=f, page_fn=page_fn)
+                    peak = tracemalloc.get_traced_memory()[1]
+                    tracemalloc.stop()
+                    results.append(f"{name} {peak / 1048576:.1f}MB peak in {time.perf_counter() - start:.2f}s")
+        finally:
+            os.unlink(mp3_fn)
+        print(f"{count:,} words: " + ", ".join(results))
+
+@opt("Check the rolling gap median makes the same paragraph breaks as a full scan of the window")
+def check_gaps(runs=2000, words=300):
+    rand = random.Random(1)
+    bad = 0
+    for run in range(runs):
+        ticks = run % 2 == 0
+        window = rand.randint(1, 25)
+        fast = templater.IsParagraph(ticks=ticks, window=window)
+        brute = BruteParagraph(ticks=ticks, window=window)
+        # Use a small set of gap lengths so there are lots of ties
+        choices = [rand.choice([0, 1, 5, 10, 20, 30, 50, 100, 250, 300, 1000]) for _ in range(6)]
+        at = 0
+        for _ in range(words):
+            at += rand.choice(choices)
+            start, end = at, at + rand.randint(1, 40)
+            at = end
+            if not ticks:
+                start, end = Decimal(start) / 100, Decimal(end) / 100
+            else:
+                start, end = start * templater.TICKS // 100, end * templater.TICKS // 100
+            word = rand.choice(["word", "word.", "word?", "word,"])
+            fast.check(word, start, end)
+            brute.check(word, start, end)
+            if (fast.was_sentence, fast.was_paragraph) != (brute.was_sentence, brute.was_paragraph):
+                bad += 1
+                break
+    print(f"Checked {runs:,} runs of {words:,} words, {bad:,} mismatches")
+
+@opt("Time the paragraph check as the gap window grows")
+def gap_window(words=40000):
+    data, mp3_fn = make_words(words)
+    os.unlink(mp3_fn)
+    data = list(templater.iter_ticks(data, False))
+    for window in [10, 100, 1000]:
+        for name, cls in [("rolling", templater.IsParagraph), ("full scan", BruteParagraph)]:
+            if name == "full scan" and window > 100:
+                continue
+            is_para = cls(ticks=True, window=window)
+            start = time.perf_counter()
+            for word in data:
+                is_para.check(word['word'], word['start'], word['end'])
+            print(f"Window {window:,}, {name}: {time.perf_counter() - start:.3f}s")
+
+@opt("Time rebuilding the pages and search data for a feed where nothing has changed")
+def noop_rebuild(episodes=2000, words=300):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        # A feed of short transcripts, laid out like transcribe_feed does it
+        os.mkdir(os.path.join(temp_dir, "media"))
+        cache = {}
+        for i in range(episodes):
+            data, mp3_fn = make_words(words, seed=i + 1)
+            fn = f"ep{i:05d}.mp3"
+            shutil.move(mp3_fn, os.path.join(temp_dir, "media", fn))
+            with gzip.open(os.path.join(temp_dir, "media", fn + ".json.gz"), "wt", encoding="utf-8") as f:
+                json.dump(data, f)
+            cache[str(i)] = {
+                "pub_date": f"{2000 + i * 20 // episodes}-{i % 12 + 1:02d}-01 10:00:00",
+                "title": f"Episode {i}",
+                "link": f"https://example.com/{i}",
+                "filename": fn,
+            }
+        with open(os.path.join(temp_dir, "cache.json"), "wt") as f:
+            json.dump(cache, f)
+
+        # The manifest doesn't trust the hashes of files changed in the last
+        # couple of seconds, so make everything look older than that
+        old = time.time() - 60
+        for dirpath, _, filenames in os.walk(temp_dir):
+            for cur in filenames:
+                os.utime(os.path.join(dirpath, cur), (old, old))
+
+        commands = [
+            ("rerender", ["python3", "to_text.py", "rerender", temp_dir]),
+            ("make_search_page", ["python3", "make_search_page.py", temp_dir]),
+        ]
+        for name, cmd in commands:
+            started = time.time()
+            subprocess.run(cmd, stdout=subprocess.DEVNULL, check=True)
+            first = time.time() - started
+            # Run it again with nothing changed, best of a few runs
+            again, _ = time_it(lambda: subprocess.run(cmd, stdout=subprocess.DEVNULL, check=True), 3)
+            print(f"{name}: {episodes:,} episodes, first build {first:.2f}s, with nothing changed {again:.2f}s")
+
+        # For reference, how much of that is just starting Python
+        started = time.time()
+        subprocess.run(["python3", "-c", "pass"], check=True)
+        print(f"Starting Python on its own takes {time.time() - started:.2f}s")
+
+class FakeAWS:
+    # Just enough of S3 and Transcribe for the Transcribe engine, with a fake
+    # clock, so running jobs, failures, and clean up can be checked without
+    # an AWS account.  Files with "fail" in them fail to transcribe.
+    def __init__(self):
+        import threading
+        self.lock = threading.Lock()
+        self.now = 1000000.0
+        self.objects = {}
+        self.jobs = {}
+        self.uploading = 0
+        self.max_uploading = 0
+        self.max_jobs = 0
+
+    # The time module, as the engine sees it
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        # Give the upload threads a chance to run
+        time.sleep(0.001)
+        self.now += seconds
+
+    # boto3, as the engine sees it
+    def Session(self, **kwargs):
+        return self
+
+    def client(self, name, **kwargs):
+        return self
+
+    # S3
+    def upload_file(self, fn, bucket, key, Config=None):
+        with self.lock:
+            self.uploading += 1
+            self.max_uploading = max(self.max_uploading, self.uploading)
+        time.sleep(0.05)
+        with open(fn, "rb") as f:
+            data = f.read()
+        with self.lock:
+            self.objects[key] = data
+            self.uploading -= 1
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop(Key, None)
+
+    def get_object(self, Bucket, Key):
+        return {"Body": io.BytesIO(self.objects[Key])}
+
+    # Transcribe
+    def start_transcription_job(self, TranscriptionJobName, Media, OutputKey, **kwargs):
+        key = Media['MediaFileUri'].split("/", 3)[3]
+        if key not in self.objects:
+            raise Exception(f"Job started before {key} was uploaded")
+        self.jobs[TranscriptionJobName] = {"key": key, "output": OutputKey, "done_at": self.now + 120}
+        self.max_jobs = max(self.max_jobs, len(self.jobs))
+
+    def get_transcription_job(self, TranscriptionJobName):
+        job = self.jobs[TranscriptionJobName]
+        data = self.objects[job["key"]]
+        if self.now < job["done_at"]:
+            status = "IN_PROGRESS"
+        elif b"fail" in data:
+            status = "FAILED"
+        else:
+            status = "COMPLETED"
+            self.objects[job["output"]] = json.dumps({"results": {"items": [
+                {"alternatives": [{"content": data.decode("utf-8")}], "start_time": "0.0", "end_time": "1.0"},
+            ]}}).encode("utf-8")
+        return {"TranscriptionJob": {"TranscriptionJobStatus": status, "FailureReason": "fake failure"}}
+
+    def delete_transcription_job(self, TranscriptionJobName):
+        del self.jobs[TranscriptionJobName]
+
+@opt("Check the Transcribe engine's batches against a fake S3 and Transcribe")
+def check_transcribe(chunks=8, max_jobs=3):
+    import sys
+    import types
+    from engines import transcribe
+    bad, total = 0, 0
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for failing in [None, chunks // 2]:
+            sources = []
+            for i in range(chunks):
+                fn = os.path.join(temp_dir, f"chunk_{i}.mp3")
+                with open(fn, "wt") as f:
+                    f.write("fail" if i == failing else f"chunk{i}")
+                sources.append((fn, 60 * (i + 1)))
+
+            # Point the engine at the fakes, for this run only
+            fake = FakeAWS()
+            modules = {"boto3": fake, "boto3.s3": types.SimpleNamespace(), "boto3.s3.transfer": types.SimpleNamespace(TransferConfig=dict)}
+            old_modules = {x: sys.modules.get(x) for x in modules}
+            sys.modules.update(modules)
+            transcribe.time = fake
+            settings = {"s3_bucket": "bucket", "s3_prefix": "prefix/", "max_jobs": str(max_jobs)}
+            try:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    results = transcribe.run_engine_batch(settings, sources)
+                error = None
+            except Exception as e:
+                error = str(e)
+            finally:
+                transcribe.time = time
+                for key, value in old_modules.items():
+                    if value is None:
+                        del sys.modules[key]
+                    else:
+                        sys.modules[key] = value
+
+            checks = [
+                ("more than one upload ran at once", fake.max_uploading > 1),
+                (f"more than one job, and at most {max_jobs}, ran at once", 1 < fake.max_jobs <= max_jobs),
+                ("nothing was left in S3", len(fake.objects) == 0),
+                ("no jobs were left", len(fake.jobs) == 0),
+            ]
+            if failing is None:
+                words = [transcribe.parse_data(x)[0][0] if x is not None else None for x in results]
+                checks.append(("results came back in order", words == [f"chunk{i}" for i in range(chunks)]))
+            else:
+                checks.append(("the failed job raised an error", error is not None and "fake failure" in error))
+            total += len(checks)
+            for desc, ok in checks:
+                if not ok:
+                    bad += 1
+                    print(f"{'With' if failing is not None else 'Without'} a failed job, expected {desc}")
+            print(f"{'With' if failing is not None else 'Without'} a failed job: {len(sources):,} chunks, up to {fake.max_uploading:,} uploads "
+                f"and {fake.max_jobs:,} jobs at once, {fake.now - 1000000:,.0f} fake seconds" + (f", error: {error}" if error is not None else ""))
+    print(f"Checked {total:,} things, {bad:,} problems")
+
+@opt("Measure the size, speed and false positive rate of the search Bloom filters")
+def search_bloom(words=40000, batches=10, lookups=20000):
+    import make_search_page
+    keys = []
+    for seed in range(batches):
+        data, mp3_fn = make_words(words, seed=seed + 1)
+        os.unlink(mp3_fn)
+        text = " ".join(x[0] for x in data)
+        cur = set(make_search_page.term_positions(text))
+        cur.update(make_search_page.trigrams(text))
+        keys.append(cur)
+    rand = random.Random(1)
+    missing = ["".join(rand.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(12)) for _ in range(lookups)]
+    print(f"{batches:,} batches of {words:,} words, {sum(len(x) for x in keys) / batches:,.0f} keys per batch")
+    for rate in [0.001, 0.01, 0.05, 0.1]:
+        start = time.perf_counter()
+        filters = []
+        for cur in keys:
+            bloom = make_search_page.BloomFilter(len(cur), rate, make_search_page.DEFAULT_OPTIONS['bloom_bytes'])
+            for key in cur:
+                bloom.add(key)
+            filters.append(bloom)
+        built = time.perf_counter() - start
+        start = time.perf_counter()
+        hits = sum(1 for bloom in filters for key in missing if key in bloom)
+        lookup = (time.perf_counter() - start) / (lookups * batches) * 1000000
+        size = sum(len(x.to_json()[1]) for x in filters) / batches
+        print(f"Target {rate:.1%}: {size:,.0f} bytes per batch in the index, built in {built / batches * 1000:.1f}ms, "
+            f"{lookup:.2f}us per lookup, {hits / (lookups * batches):.2%} false positives")
+
+NODE_SEARCH = r"""
+import fs from 'fs';
+import path from 'path';
+/* how is count for the totals of each search, or hits for the first page
+   of results, with -full to search every episode without using the index */
+const [pageFn, dataDir, queriesFn, how] = process.argv.slice(2);
+const page = fs.readFileSync(pageFn, 'utf8');
+let script = page.slice(page.indexOf('<script>') + 8, page.lastIndexOf('</script>'));
+if (how.endsWith('-full')) {
+    script += '\nbloomCheck = () => true;\nzoneCheck = () => true;\nfindCandidates = async () => null;';
+}
+
+class Elem {
+    constructor(tag) { this.tagName = tag; this.children = []; this.style = {}; this.value = ''; this.checked = false; this.innerText = ''; }
+    appendChild(x) { this.children.push(x); return x; }
+    replaceChildren(...x) { this.children = x; }
+    addEventListener() {}
+    focus() {}
+    blur() {}
+    scrollIntoView() {}
+    set innerHTML(value) { this.innerText = value; }
+    get innerHTML() { return this.innerText; }
+    get classList() { return {add() {}, remove() {}}; }
+}
+function dump(x) {
+    if (x.text !== undefined) {
+        return x.text;
+    }
+    let ret = (x.href ? '<' + x.href + '>' : '') + x.innerText;
+    for (const child of x.children) {
+        ret += dump(child);
+    }
+    return ret + '\n';
+}
+let bytes = 0;
+async function fetch(url, opts) {
+    let data = fs.readFileSync(path.join(dataDir, url));
+    const range = /bytes=(\d+)-(\d+)/.exec(opts?.headers?.Range ?? '');
+    if (range) {
+        data = data.subarray(Number(range[1]), Number(range[2]) + 1);
+    }
+    bytes += data.length;
+    return new Response(data);
+}
+
+const ret = [];
+for (const query of JSON.parse(fs.readFileSync(queriesFn, 'utf8'))) {
+    /* A fresh copy of the page for each search, so nothing carries over */
+    const ids = {};
+    const document = {
+        getElementById(id) { return ids[id] || (ids[id] = new Elem('div')); },
+        createElement(tag) { return new Elem(tag); },
+        createTextNode(value) { return {text: value}; },
+        addEventListener() {},
+        getElementsByTagName() { return []; },
+        querySelectorAll() { return []; },
+        querySelector() { return new Elem('div'); },
+    };
+    ids['search_type'] = Object.assign(new Elem('select'), {value: query.mode});
+    ids['similar'] = Object.assign(new Elem('input'), {checked: query.similar});
+    ids['reverse'] = Object.assign(new Elem('input'), {checked: query.reverse});
+    ids['start'] = Object.assign(new Elem('input'), {value: query.after ?? ''});
+    ids['end'] = Object.assign(new Elem('input'), {value: query.before ?? ''});
+    ids['target_group'] = Object.assign(new Elem('input'), {value: query.group ?? ''});
+    const page = new Function('document', 'window', 'navigator', 'fetch', script + '\nreturn {searchFor};')(
+        document, {location: {hash: ''}, scrollTo() {}}, {userAgent: 'chrome'}, fetch);
+    try {
+        if (how.startsWith('count')) {
+            await page.searchFor(query.query, 0, true);
+            ret.push(ids['totalsCount'].innerText);
+        } else {
+            await page.searchFor(query.query, 0, false);
+            ret.push(ids['totalsCount'].innerText + '\n' + dump(ids['results']));
+        }
+    } catch (e) {
+        ret.push('error');
+    }
+}
+console.log(JSON.stringify({results: ret, bytes: bytes}));
+"""
+
+def make_search_feed(temp_dir, episodes, words, rand):
+    # Build a small feed, with several batches, a few groups, and the lemma
+    # data the similar search uses.  Each episode also gets a few made up
+    # words, so some searches only match a handful of episodes.  Returns the
+    # common words, and the made up ones.
+    import build_manifest
+    import make_search_page
+    os.mkdir(os.path.join(temp_dir, "media"))
+    cache = {}
+    vocab, rare = set(), []
+    for i in range(episodes):
+        data, mp3_fn = make_words(words, seed=i + 1)
+        os.unlink(mp3_fn)
+        vocab.update(x[0].lower().strip(".,?!") for x in data)
+        for _ in range(3):
+            word = "".join(rand.choice("bdfgklmnprstvz") + rand.choice("aeiou") for _ in range(3))
+            at = rand.randrange(len(data))
+            data[at] = (word,) + tuple(data[at][1:])
+            rare.append(word)
+        with gzip.open(os.path.join(temp_dir, "media", f"ep{i:03d}.mp3.json.gz"), "wt", encoding="utf-8") as f:
+            json.dump(data, f)
+        cache[str(i)] = {
+            "pub_date": f"{2015 + i * 10 // episodes}-{i % 12 + 1:02d}-01 10:00:00",
+            "title": f"Episode {i} " + " ".join(x[0] for x in data[:3]),
+            "link": f"https://example.com/{i}",
+            "filename": f"ep{i:03d}.mp3",
+        }
+        if i % 3 > 0:
+            cache[str(i)]["group"] = ["one", "two"][i % 3 - 1]
+    shutil.copy(os.path.join("search", "search_data_lemma.dat"), temp_dir)
+    items = sorted(cache.values(), key=lambda x: x['pub_date'])
+    manifest = build_manifest.Manifest(temp_dir)
+    options = dict(make_search_page.DEFAULT_OPTIONS, batch_size=words * episodes)
+    with contextlib.redirect_stdout(io.StringIO()):
+        make_search_page.build_search_data(temp_dir, cache, items, manifest, True, options)
+    return sorted(x for x in vocab if len(x) > 2), rare
+
+def search_queries(vocab, rare, rand):
+    # A spread of searches in each mode, for common and rare words
+    queries = []
+    for _ in range(10):
+        a, b, c = rand.sample(vocab, 3)
+        r, s = rand.sample(rare, 2)
+        queries += [
+            {"query": a}, {"query": f"{a[1:]} {b[:2]}"}, {"query": a[:2], "reverse": True},
+            {"query": f"{a[0]}[a-z]{a[2]}", "mode": "regex"}, {"query": f"({a}|{b}) {c[0]}", "mode": "regex"},
+            {"query": f"{a} AND {b}", "mode": "logic"}, {"query": f"{a} OR {b} AND NOT {c}", "mode": "logic"},
+            {"query": f"{a[:3]} NEAR {b[:3]}", "mode": "logic"}, {"query": f"WHOLE {a} NEAR {b} NEAR {c}", "mode": "logic"},
+            {"query": f"( {a} OR {b} ) AND {c}", "mode": "logic"}, {"query": f"{a} AND", "mode": "logic"},
+            {"query": a[:2], "mode": "title"}, {"query": a, "similar": True},
+            {"query": a[:2], "after": "2017-06-01", "before": "2021"}, {"query": a[:2], "group": "two"},
+            {"query": r}, {"query": r[1:5]}, {"query": f"{r} {a}"}, {"query": r[:4] + "zz"},
+            {"query": f"{r[:2]}.{r[3:]}", "mode": "regex"}, {"query": f"{r}|{s}", "mode": "regex"},
+            {"query": f"{r} OR {s}", "mode": "logic"}, {"query": f"{r} AND {a}", "mode": "logic"},
+            {"query": f"{r} NEAR {a[:3]}", "mode": "logic"}, {"query": r, "after": "2019-01-01"},
+        ]
+    for x in queries:
+        x["mode"] = x.get("mode", "raw")
+        x["similar"] = x.get("similar", False)
+        x["reverse"] = x.get("reverse", False)
+    return queries
+
+def run_page_searches(temp_dir, queries, how):
+    # Run searches through the search page under node, see NODE_SEARCH for
+    # what how can be, returns the results and the bytes the page read
+    if shutil.which("node") is None:
+        raise Exception("This check needs node")
+    script_fn = os.path.join(temp_dir, "search.mjs")
+    with open(script_fn, "wt") as f:
+        f.write(NODE_SEARCH)
+    queries_fn = os.path.join(temp_dir, "queries.json")
+    with open(queries_fn, "wt") as f:
+        json.dump(queries, f)
+    result = subprocess.run(["node", script_fn, os.path.join("search", "search.html"), temp_dir, queries_fn, how], stdout=subprocess.PIPE, check=True)
+    result = json.loads(result.stdout)
+    return result["results"], result["bytes"]
+
+@opt("Check the Python search library finds the same hits as the search page")
+def check_search(episodes=40, words=2000):
+    import search_data
+    rand = random.Random(1)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        vocab, rare = make_search_feed(temp_dir, episodes, words, rand)
+        queries = search_queries(vocab, rare, rand)
+        expected, _ = run_page_searches(temp_dir, queries, "count")
+
+        bad = 0
+        with search_data.SearchData(temp_dir) as data:
+            for query, want in zip(queries, expected):
+                try:
+                    hits, titles = data.count(query['query'], mode=query['mode'], similar=query['similar'],
+                        after=query.get('after'), before=query.get('before'), group=query.get('group'), reverse=query['reverse'])
+                    got = f"Found {hits:,} hits in {titles:,} episodes"
+                except Exception:
+                    got = "error"
+                if got != want:
+                    bad += 1
+                    print(f"Mismatch for {json.dumps(query)}: page found '{want}', library found '{got}'")
+    print(f"Checked {len(queries):,} searches, {bad:,} mismatches")
+
+@opt("Check the search page finds the same hits with its index as it does searching every episode")
+def check_pruning(episodes=40, words=2000):
+    rand = random.Random(2)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        vocab, rare = make_search_feed(temp_dir, episodes, words, rand)
+        queries = search_queries(vocab, rare, rand)
+        bad = 0
+        # Compare the totals, and the hits themselves on the first page
+        for how in ["count", "hits"]:
+            pruned, pruned_bytes = run_page_searches(temp_dir, queries, how)
+            full, full_bytes = run_page_searches(temp_dir, queries, how + "-full")
+            for query, got, want in zip(queries, pruned, full):
+                if got != want:
+                    bad += 1
+                    print(f"Mismatch for {json.dumps(query)} ({how}): with the index '{got[:200]}', searching everything '{want[:200]}'")
+            print(f"{how}: read {pruned_bytes:,} bytes with the index, {full_bytes:,} bytes searching everything")
+    print(f"Checked {len(queries) * 2:,} searches, {bad:,} mismatches")
+
+if __name__ == "__main__":
+    main_entry('func')
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+
+# Keeps track of the inputs each generated file was built from, so only the
+# outputs that are out of date need to be built again.  Like git's index, the
+# hash of each input file is cached along with its size and mtime, so checking
+# a file that hasn't changed only costs a stat.
+
+from audio_cache import hash_file
+from mp3_splitter import ReadMP3
+import contextlib
+import json
+import os
+import tempfile
+import time
+
+MANIFEST_NAME = "build_manifest.json"
+VERSION = 1
+# How long a lock on the manifest can be held before it's assumed to be left
+# over from a process that died
+STALE_LOCK_SECONDS = 30
+
+class Manifest:
+    def __init__(self, target_dir):
+        self.target_dir = os.path.abspath(target_dir)
+        self.fn = os.path.join(self.target_dir, MANIFEST_NAME)
+        self.files = {}
+        self.durations = {}
+        self.outputs = {}
+        # The keys changed in each section, so they can be merged with changes
+        # other processes made to the same manifest
+        self.changed = {"files": set(), "durations": set(), "outputs": set()}
+        self.load()
+
+    @property
+    def dirty(self):
+        return any(len(x) > 0 for x in self.changed.values())
+
+    def load(self):
+        self.files, self.durations, self.outputs = {}, {}, {}
+        if os.path.isfile(self.fn):
+            try:
+                with open(self.fn, "rt", encoding="utf-8") as f:
+                    data = json.load(f)
+                if data.get("version") == VERSION:
+                    self.files = data["files"]
+                    self.durations = data["durations"]
+                    self.outputs = data["outputs"]
+            except ValueError:
+                # A damaged manifest just means everything is built again
+                pass
+
+    def key(self, fn):
+        return os.path.relpath(os.path.abspath(fn), self.target_dir).replace("\\", "/")
+
+    def is_stable(self, stat):
+        # A file changed in the last couple of seconds could change again
+        # without the mtime moving, so don't trust the cache for it yet
+        return time.time() - stat.st_mtime > 2
+
+    def file_hash(self, fn):
+        # The hash of a file's contents, only reading it if it's changed
+        stat = os.stat(fn)
+        key = self.key(fn)
+        cached = self.files.get(key)
+        if cached is not None and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            return cached[2]
+        ret = hash_file(fn)
+        if self.is_stable(stat):
+            self.files[key] = [stat.st_size, stat.st_mtime_ns, ret]
+            self.changed["files"].add(key)
+        return ret
+
+    def file_stamp(self, fn):
+        # A cheap stand in for the hash of a large file that's never edited
+        stat = os.stat(fn)
+        return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+    def mp3_duration(self, fn, compute=True):
+        # The duration of an MP3 file, returns None if it's not known and
+        # compute isn't set
+        stat = os.stat(fn)
+        cached = self.durations.get(self.key(fn))
+        if cached is not None and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            return cached[2]
+        if not compute:
+            return None
+        with open(fn, "rb") as f:
+            ret = ReadMP3.get_duration(f)
+        self.set_mp3_duration(fn, ret)
+        return ret
+
+    def set_mp3_duration(self, fn, duration):
+        stat = os.stat(fn)
+        if self.is_stable(stat):
+            self.durations[self.key(fn)] = [stat.st_size, stat.st_mtime_ns, duration]
+            self.changed["durations"].add(self.key(fn))
+
+    def is_current(self, name, inputs):
+        # Returns True if the output was built from these inputs, and none of
+        # the files it created have changed since
+        cached = self.outputs.get(name)
+        if cached is None or cached["inputs"] != inputs:
+            return False
+        for key, (size, mtime_ns) in cached["files"].items():
+            try:
+                stat = os.stat(os.path.join(self.target_dir, key))
+            except FileNotFoundError:
+                return False
+            if stat.st_size != size or stat.st_mtime_ns != mtime_ns:
+                return False
+        return True
+
+    def inputs(self, name):
+        # The inputs an output was last built from, or None if it's not known
+        cached = self.outputs.get(name)
+        return None if cached is None else cached["inputs"]
+
+    def forget(self, name):
+        if name in self.outputs:
+            del self.outputs[name]
+            self.changed["outputs"].add(name)
+
+    def record(self, name, inputs, files):
+        # Note that an output was built from these inputs, creating these files
+        temp = {}
+        for fn in files:
+            stat = os.stat(fn)
+            temp[self.key(fn)] = [stat.st_size, stat.st_mtime_ns]
+        self.outputs[name] = {"inputs": inputs, "files": temp}
+        self.changed["outputs"].add(name)
+
+    @contextlib.contextmanager
+    def lock(self):
+        # Pages can be rendered by several processes at once, so only let one
+        # of them update the manifest at a time
+        lock_fn = self.fn + ".lock"
+        while True:
+            try:
+                os.close(os.open(lock_fn, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                break
+            except FileExistsError:
+                try:
+                    if time.time() - os.stat(lock_fn).st_mtime > STALE_LOCK_SECONDS:
+                        os.unlink(lock_fn)
+                        continue
+                except FileNotFoundError:
+                    continue
+                time.sleep(0.05)
+        try:
+            yield
+        finally:
+            os.unlink(lock_fn)
+
+    def save(self):
+        if not self.dirty:
+            return
+        with self.lock():
+            # Start with what's on disk, in case another process saved since
+            # this one loaded it, and apply the changes made here on top
+            ours = {"files": self.files, "durations": self.durations, "outputs": self.outputs}
+            self.load()
+            for section, keys in self.changed.items():
+                cache = getattr(self, section)
+                for key in keys:
+                    if key in ours[section]:
+                        cache[key] = ours[section][key]
+                    elif key in cache:
+                        del cache[key]
+            # Forget about inputs that have been removed
+            for cache in [self.files, self.durations]:
+                for key in [x for x in cache if not os.path.isfile(os.path.join(self.target_dir, x))]:
+                    del cache[key]
+            data = {
+                "version": VERSION,
+                "files": self.files,
+                "durations": self.durations,
+                "outputs": self.outputs,
+            }
+            f, temp_fn = tempfile.mkstemp(".tmp", MANIFEST_NAME + ".", self.target_dir)
+            try:
+                with open(f, "wt", newline="", encoding="utf-8") as f:
+                    json.dump(data, f, separators=(",", ":"))
+                # mkstemp only lets the owner read it
+                os.chmod(temp_fn, 0o644)
+                os.replace(temp_fn, self.fn)
+            except:
+                os.unlink(temp_fn)
+                raise
+        for keys in self.changed.values():
+            keys.clear()
+
+if __name__ == "__main__":
+    print("This module is not meant to be run directly.")
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+
+import json
+
+# A small vocabulary to build sentences from, weighted toward short common words
+# the way real speech is
+WORDS = (
+    "the the the and and to to of of a a a in is is it it that that you you "
+    "we we i i this for on was with be are have as at so but not they "
+    "just like what about there all can do if or one know think get out "
+    "space station crew orbit earth mission launch rocket module science "
+    "experiment research astronaut nasa houston podcast episode today year "
+    "time people work really going things little lot way right well kind "
+    "very much more some when then now here also because over into back "
+    "first new great long big small different important international"
+).split()
+ENDINGS = [".", ".", ".", ".", "?", "!"]
+
+def get_name():
+    return "Synthetic Null Engine (for testing and benchmarks)"
+
+def get_id():
+    return "null"
+
+def get_settings():
+    return {
+        "limit_seconds": 7200, # Chunk like the Whisper engines so chunk offsets get exercised
+    }
+
+def get_opts():
+    return [
+        ("seed", "Random seed for the generated transcript (leave blank for 1)"),
+        ("words_per_second", "Words per second of audio to generate (leave blank for 2.5)"),
+        ("max_words", "Stop after this many words (leave blank for no limit)"),
+        ("duration", "Seconds of audio to transcribe, at most the MP3's length (leave blank to use the MP3's length)"),
+        ("speakers", "Number of speakers to generate (leave blank for 2, 0 for no speaker labels)"),
+        ("phrases", "Output phrases instead of words, like Whisper does (yes/no, defaults to no)"),
+        ("latency", "Seconds to wait before returning results (leave blank for none)"),
+        ("failure_rate", "Chance from 0 to 1 that a call fails (leave blank for never)"),
+    ]
+
+def get_value(settings, key, default, parser=float):
+    value = str(settings.get(key, ""))
+    if len(value) == 0:
+        return default
+    return parser(value)
+
+def create_silent_mp3(fn, seconds):
+    # Write an MP3 file of silence that's just enough to be a valid source
+    # file for benchmarks.  It's MPEG-2.5 Layer III, 8kbps, 8kHz, mono, with
+    # empty frames, about 1kb per second of audio.
+    frame = bytes([0xff, 0xe3, 0x18, 0xc0]) + b'\x00' * 68
+    frames = int(seconds * 8000 / 576) + 1
+    with open(fn, "wb") as f:
+        while frames > 0:
+            f.write(frame * min(1000, frames))
+            frames -= 1000
+
+def run_engine(settings, source_fn):
+    import os
+    import random
+    import time
+    from mp3_splitter import ReadMP3
+
+    latency = get_value(settings, "latency", 0)
+    if latency > 0:
+        time.sleep(latency)
+
+    # Failures aren't seeded, so a retry can succeed
+    if random.random() < get_value(settings, "failure_rate", 0):
+        raise Exception("Simulated engine failure")
+
+    # Never go past the end of the file, when the episode is split up each
+    # chunk is passed in on its own
+    with open(source_fn, "rb") as f:
+        duration = ReadMP3.get_duration(f)
+    duration = min(get_value(settings, "duration", duration), duration)
+
+    # Seed with the size of the file too, so each chunk gets different, but
+    # repeatable, words
+    seed = get_value(settings, "seed", 1, int)
+    rand = random.Random(f"{seed}-{os.path.getsize(source_fn)}")
+    words_per_second = get_value(settings, "words_per_second", 2.5)
+    max_words = get_value(settings, "max_words", None, int)
+    speakers = get_value(settings, "speakers", 2, int)
+    phrases = get_value(settings, "phrases", False, lambda x: x.lower() in {"true", "yes", "y"})
+
+    segments = []
+    at = rand.uniform(0, 2)
+    speaker = 0
+    total = 0
+    word_len = 1 / words_per_second
+    while at < duration and (max_words is None or total < max_words):
+        # Build up a sentence of words, with a pause after
+        words = []
+        count = rand.randint(3, 20)
+        for i in range(count):
+            if at >= duration or (max_words is not None and total >= max_words):
+                break
+            word = rand.choice(WORDS)
+            if i == 0:
+                word = word.capitalize()
+            elif i < count - 1 and rand.random() < 0.08:
+                word += ","
+            length = word_len * rand.uniform(0.5, 1.5)
+            words.append({
+                "word": word,
+                "start": round(at, 3),
+                "end": round(min(at + length * 0.85, duration), 3),
+                "speaker": speaker,
+            })
+            at += length
+            total += 1
+        if len(words) == 0:
+            break
+        words[-1]["word"] += rand.choice(ENDINGS)
+        segments.append({
+            "start": words[0]["start"],
+            "end": words[-1]["end"],
+            "text": " ".join(x["word"] for x in words),
+            "words": words,
+        })
+
+        # Pause between sentences, with the occasional long gap, and
+        # sometimes switch to a new speaker
+        at += rand.choice([0.1, 0.2, 0.3, 0.5, 0.8, 3.0])
+        if speakers > 1 and rand.random() < 0.2:
+            speaker = (speaker + rand.randint(1, speakers - 1)) % speakers
+
+    if speakers == 0 or phrases:
+        for segment in segments:
+            for word in segment["words"]:
+                del word["speaker"]
+
+    results = {"phrases": phrases, "segments": segments}
+    return json.dumps(results, separators=(",", ":")).encode("utf-8")
+
+def parse_data(data):
+    ret = []
+
+    data = json.loads(data)
+
+    # For the case where only one item is transcribed, treat it
+    # as a group of one item
+    if isinstance(data, dict):
+        data = [data]
+
+    for cur in data:
+        for item in cur['segments']:
+            if cur['phrases']:
+                ret.append((item['text'], item['start'], item['end']))
+            else:
+                for word in item['words']:
+                    ret.append((word['word'], word['start'], word['end'], word.get('speaker', -1)))
+
+    return ret
+
+if __name__ == "__main__":
+    print("This module is not meant to be run directly")
@@ -27,9 +27,10 @@ def get_opts():
         ("region_name", "AWS Region to use (leave blank to use key/role information)"),
         ("s3_bucket", "S3 Bucket to use to store artifacts (must exist)"),
         ("s3_prefix", "Prefix to store data in S3 Bucket (can be blank)"),
+        ("max_jobs", "Maximum number of transcription jobs to run at once (leave blank for 4)"),
     ]
 
-def run_engine(settings, source_fn):
+def get_clients(settings):
     import boto3
 
     args = {}
@@ -45,43 +46,127 @@ def run_engine(settings, source_fn):
     transcribe = session.client('transcribe', **args)
     s3 = session.client('s3', **args)
 
-    now = datetime.now(UTC).replace(tzinfo=None).strftime("%Y%m%d-%H%M%S")
-    job_id = "transcribe_" + now + "-" + "".join(chr(ord('a') + random.randint(0, 25)) for _ in range(10))
-    s3_key = settings['s3_prefix'] + job_id + ".mp3"
-
-    print(f"Uploading {source_fn} to s3://{settings['s3_bucket']}/{s3_key}")
-    s3.upload_file(source_fn, settings['s3_bucket'], s3_key)
-
-    print("Starting transcription")
-    transcribe.start_transcription_job(
-        LanguageCode='en-US',
-        MediaFormat='mp3',
-        TranscriptionJobName=job_id,
-        Media={'MediaFileUri': f"s3://{settings['s3_bucket']}/{s3_key}"},
-        OutputBucketName=settings['s3_bucket'],
-        OutputKey=s3_key + ".json",
-    )
+    return transcribe, s3
+
+def poll_delay(duration, elapsed):
+    # Transcribe tends to take a fraction of the audio's length to finish, so
+    # don't bother asking about a job till it's likely to be close to done, then
+    # check back more often once it's overdue
+    expected = max(30, duration * 0.25)
+    if elapsed < expected:
+        return min(max(expected - elapsed, 5), 60)
+    return min(max(expected * 0.1, 5), 30)
+
+def run_engine(settings, source_fn):
+    from mp3_splitter import ReadMP3
+
+    with open(source_fn, "rb") as f:
+        duration = ReadMP3.get_duration(f)
 
-    while True:
-        resp = transcribe.get_transcription_job(TranscriptionJobName=job_id)
-        status = resp['TranscriptionJob']['TranscriptionJobStatus']
-        if status == "COMPLETED":
-            print("Transcription done!")
-            break
-        print(f"Working, job status is {status.lower().replace('_',' ')}...")
-        time.sleep(15)
+    return run_engine_batch(settings, [(source_fn, duration)])[0]
 
-    print("Download transcription results")
-    data = s3.get_object(Bucket=settings['s3_bucket'], Key=s3_key + ".json")['Body'].read()
+def run_engine_batch(settings, sources):
+    # Transcribe a list of (filename, duration) items, running up to max_jobs
+    # jobs at once, returns the results in the same order as sources
+    from boto3.s3.transfer import TransferConfig
+    from concurrent.futures import ThreadPoolExecutor
 
-    print("Cleaning up transcription job")
-    transcribe.delete_transcription_job(TranscriptionJobName=job_id)
+    transcribe, s3 = get_clients(settings)
 
-    print("Remove S3 objects")
-    s3.delete_object(Bucket=settings['s3_bucket'], Key=s3_key)
-    s3.delete_object(Bucket=settings['s3_bucket'], Key=s3_key + ".json")
+    max_jobs = str(settings.get("max_jobs", ""))
+    max_jobs = int(max_jobs) if len(max_jobs) > 0 else 4
+    max_jobs = max(1, max_jobs)
+
+    # Upload large files in parallel parts
+    transfer = TransferConfig(
+        multipart_threshold=8388608,
+        multipart_chunksize=8388608,
+        max_concurrency=10,
+    )
 
-    return data
+    results = [None] * len(sources)
+    todo = list(enumerate(sources))
+    running = {}
+
+    def upload(source_fn, s3_key):
+        print(f"Uploading {source_fn} to s3://{settings['s3_bucket']}/{s3_key}")
+        s3.upload_file(source_fn, settings['s3_bucket'], s3_key, Config=transfer)
+
+    def clean_up(job_id, job):
+        if job['started'] is not None:
+            transcribe.delete_transcription_job(TranscriptionJobName=job_id)
+        s3.delete_object(Bucket=settings['s3_bucket'], Key=job['s3_key'])
+        s3.delete_object(Bucket=settings['s3_bucket'], Key=job['s3_key'] + ".json")
+
+    with ThreadPoolExecutor(max_jobs) as pool:
+        try:
+            while len(todo) > 0 or len(running) > 0:
+                # Keep the queue of jobs full
+                while len(todo) > 0 and len(running) < max_jobs:
+                    i, (source_fn, duration) = todo.pop(0)
+                    now = datetime.now(UTC).replace(tzinfo=None).strftime("%Y%m%d-%H%M%S")
+                    job_id = "transcribe_" + now + "-" + "".join(chr(ord('a') + random.randint(0, 25)) for _ in range(10))
+                    s3_key = settings['s3_prefix'] + job_id + ".mp3"
+                    running[job_id] = {
+                        "i": i,
+                        "duration": duration,
+                        "s3_key": s3_key,
+                        "upload": pool.submit(upload, source_fn, s3_key),
+                        "started": None,
+                        "next_poll": None,
+                    }
+
+                # Start any jobs that have finished uploading
+                for job_id, job in running.items():
+                    if job['started'] is None and job['upload'].done():
+                        job['upload'].result()
+                        print(f"Starting transcription {job_id}")
+                        transcribe.start_transcription_job(
+                            LanguageCode='en-US',
+                            MediaFormat='mp3',
+                            TranscriptionJobName=job_id,
+                            Media={'MediaFileUri': f"s3://{settings['s3_bucket']}/{job['s3_key']}"},
+                            OutputBucketName=settings['s3_bucket'],
+                            OutputKey=job['s3_key'] + ".json",
+                        )
+                        job['started'] = time.time()
+                        job['next_poll'] = job['started'] + poll_delay(job['duration'], 0)
+
+                # And check on any jobs that are due to be checked
+                for job_id, job in list(running.items()):
+                    if job['next_poll'] is None or job['next_poll'] > time.time():
+                        continue
+                    resp = transcribe.get_transcription_job(TranscriptionJobName=job_id)
+                    status = resp['TranscriptionJob']['TranscriptionJobStatus']
+                    if status == "COMPLETED":
+                        print(f"Transcription {job_id} done, downloading results")
+                        results[job['i']] = s3.get_object(Bucket=settings['s3_bucket'], Key=job['s3_key'] + ".json")['Body'].read()
+                        clean_up(job_id, job)
+                        del running[job_id]
+                    elif status == "FAILED":
+                        raise Exception(f"Transcription {job_id} failed: {resp['TranscriptionJob'].get('FailureReason', 'unknown reason')}")
+                    else:
+                        print(f"Working, job {job_id} status is {status.lower().replace('_',' ')}...")
+                        job['next_poll'] = time.time() + poll_delay(job['duration'], time.time() - job['started'])
+
+                # Sleep till the next job needs attention
+                if len(running) > 0:
+                    wake_at = [x['next_poll'] for x in running.values() if x['next_poll'] is not None]
+                    if len(wake_at) < len(running):
+                        # Still waiting on an upload to finish
+                        wake_at.append(time.time() + 1)
+                    time.sleep(max(0, min(wake_at) - time.time()))
+        finally:
+            # Don't leave anything behind if something went wrong
+            for job_id, job in running.items():
+                try:
+                    if not job['upload'].cancel():
+                        job['upload'].result()
+                        clean_up(job_id, job)
+                except Exception as e:
+                    print(f"Unable to clean up {job_id}: {e}")
+
+    return results
 
 def parse_data(data):
     ret = []
@@ -11,6 +11,7 @@ def get_id():
 def get_settings():
     return {
         "limit_seconds": 7200, # Limit MP3 files to about 2 hours to prevent overloading Whisper
+        "local_audio": True, # Runs locally on any audio file, so silence can be trimmed first
     }
 
 def get_opts():
@@ -26,6 +27,7 @@ def run_engine(settings, source_fn):
     import os
     import subprocess
     import tempfile
+    import audio_cache
     
     temp_srt, temp_wav = None, None
 
@@ -34,17 +36,9 @@ def run_engine(settings, source_fn):
         os.close(f)
         if os.path.isfile(temp_wav):
             os.unlink(temp_wav)
-        cmd = [
-            settings['ffmpeg'], 
-            "-i", source_fn, 
-            "-f", "wav", 
-            "-ac", "1", 
-            "-acodec", "pcm_s16le", 
-            "-ar", "16000", 
-            temp_wav,
-        ]
+        audio = audio_cache.load_audio(source_fn, dtype="int16", ffmpeg=settings['ffmpeg'])
         print("Converting file to a wav...")
-        subprocess.check_call(cmd)
+        audio_cache.write_wav(audio, temp_wav)
 
         f, temp_srt = tempfile.mkstemp(".srt")
         os.close(f)
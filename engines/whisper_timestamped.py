@@ -11,6 +11,7 @@ def get_id():
 def get_settings():
     return {
         "limit_seconds": 7200, # Limit MP3 files to about 2 hours to prevent overloading Whisper
+        "local_audio": True, # Runs locally on any audio file, so silence can be trimmed first
     }
 
 def get_opts():
@@ -20,11 +21,12 @@ def get_opts():
 
 def run_engine(settings, source_fn):
     import whisper_timestamped
+    import audio_cache
 
     print("Loading model...")
     model = whisper_timestamped.load_model(settings["model"])
     print("Loading audio file...")
-    audio = whisper_timestamped.load_audio(source_fn)
+    audio = audio_cache.load_audio(source_fn)
     print("Transcribing...")
     args = {
         'best_of': 5,
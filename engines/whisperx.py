@@ -11,6 +11,7 @@ def get_id():
 def get_settings():
     return {
         "limit_seconds": 9900, # Limit MP3 files to about 2:45 to prevent overloading Whisper
+        "local_audio": True, # Runs locally on any audio file, so silence can be trimmed first
     }
 
 def get_opts():
@@ -40,6 +41,7 @@ def run_engine(settings, source_fn):
         hf_token = os.environ["HF_TOKEN"]
 
     import whisperx, torch # type: ignore
+    import audio_cache
 
     args = {
         'best_of': 5,
@@ -48,7 +50,7 @@ def run_engine(settings, source_fn):
     }
     print("Loading model...")
     model = whisperx.load_model(target_model, device, compute_type=compute_type, language="en", asr_options=args)
-    audio = whisperx.load_audio(source_fn)
+    audio = audio_cache.load_audio(source_fn)
     print("Transcribing...")
 
     result = model.transcribe(audio, batch_size=batch_size)
@@ -4,7 +4,7 @@
 
 from datetime import datetime
 from http.server import SimpleHTTPRequestHandler, HTTPServer
-import argparse, json, html, io, os, sys, urllib.parse
+import argparse, json, html, io, os, re, sys, urllib.parse
 if sys.version_info >= (3, 11): from datetime import UTC
 else: import datetime as datetime_fix; UTC=datetime_fix.timezone.utc
 
@@ -137,6 +137,13 @@ class RangeHTTPRequestHandler(SimpleHTTPRequestHandler):
         self.send_header('Content-Length', str(l))
         if fs is not None:
             self.send_header('Last-Modified', self.date_time_string(fs.st_mtime))
+        # Search data parts are named for their contents, so they never change,
+        # other than the first one that points to the rest
+        name = os.path.basename(path)
+        if re.fullmatch(r"search_data_[0-9a-f]{16}\.dat", name):
+            self.send_header('Cache-Control', 'public, max-age=31536000, immutable')
+        elif name == "search_data_00.dat":
+            self.send_header('Cache-Control', 'no-cache')
         self.end_headers()
 
         return f
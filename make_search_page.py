@@ -1,40 +1,52 @@
 #!/usr/bin/env python3
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-import gzip, io, json, os, sys
+from audio_cache import hash_file
+from hashlib import sha256
+from templater import write_varint
+import build_manifest
+import base64, contextlib, gzip, json, math, multiprocessing, os, sys, time
 if sys.version_info >= (3, 11): from datetime import UTC
 else: import datetime as datetime_fix; UTC=datetime_fix.timezone.utc
 
+# Bump this when a change here changes the data files, so they're all built again
+GENERATOR_VERSION = 7
+# Parts a build stops using are kept this long, for pages loaded before it
+OLD_PART_HOURS = 24
+# How many terms to put in each block of a batch's term dictionary
+TERMS_PER_SHARD = 2048
+# Options that can be changed on the command line, as name=value
+DEFAULT_OPTIONS = {
+    # Once a batch of episodes is about this many bytes, start a new one
+    "batch_size": 10485760,
+    # The false positive rate to size each batch's Bloom filter for
+    "bloom_fp": 0.01,
+    # The most bytes a batch's Bloom filter can use, a larger rate is used
+    # for batches with too many words and trigrams to fit
+    "bloom_bytes": 65536,
+}
+
 class DumpData:
-    def __init__(self, target_size):
-        self.i = -1
+    # Writes each part to a temporary file in the target folder, so only one
+    # batch needs to be in memory at a time.  Nothing is visible until
+    # publish() names each part for its contents and moves it into place.
+    def __init__(self, target, target_size):
+        self.target = target
+        self.i = 0
         self.off = 0
         self.f = None
-        self.existing = False
         self.total_files = 0
         self.total_bytes = 0
         self.target_size = target_size
         self.data = {}
-        self.skipped = set()
-    
-    def move_to(self, file_number):
-        self.close()
-        self.i = file_number - 1
-        self.existing = True
 
-    def skip(self):
-        if self.f is not None:
-            self.f = None
+    def next_part(self):
+        self.close()
         self.i += 1
-        self.skipped.add(self.i)
-        if self.i >= 100:
-            raise Exception("Too many part files")
-        if not self.existing:
-            self.data[self.i] = io.BytesIO()
-            self.total_files += 1
-        self.f = self.data[self.i]
-        if self.existing:
-            self.f.seek(0, os.SEEK_SET)
+        self.data[self.i] = os.path.join(self.target, part_name(self.i) + ".tmp")
+        self.f = open(self.data[self.i], "wb")
+        self.total_files += 1
         self.off = 0
 
     def write(self, value, compress=True, next_segment=False):
@@ -50,18 +62,7 @@ class DumpData:
         if self.f is None:
             next_segment = True
         if next_segment:
-            if self.f is not None:
-                self.f = None
-            self.i += 1
-            if self.i >= 100:
-                raise Exception("Too many part files")
-            if not self.existing:
-                self.data[self.i] = io.BytesIO()
-                self.total_files += 1
-            self.f = self.data[self.i]
-            if self.existing:
-                self.f.seek(0, os.SEEK_SET)
-            self.off = 0
+            self.next_part()
         ret = [self.i, self.off, len(value)]
         self.f.write(value)
         self.off += len(value)
@@ -70,112 +71,492 @@ class DumpData:
     
     def close(self):
         if self.f is not None:
+            self.f.close()
             self.f = None
 
+    def publish(self):
+        # Name each part written since the last call for its contents, and
+        # move it into place, returns the name for each part number
+        self.close()
+        ret = {}
+        for i, fn in self.data.items():
+            ret[i] = hash_file(fn)[:16]
+            os.replace(fn, os.path.join(self.target, part_name(ret[i])))
+        self.data = {}
+        return ret
+
+    def discard(self):
+        # Remove anything not published, when the build fails
+        self.close()
+        for fn in self.data.values():
+            if os.path.isfile(fn):
+                os.unlink(fn)
+        self.data = {}
+
+class BloomFilter:
+    # A Bloom filter using FNV-1a, with double hashing to find each bit, the
+    # search page has the same lookup
+    def __init__(self, count, false_positive, max_bytes):
+        bits = -max(count, 1) * math.log(false_positive) / (math.log(2) ** 2)
+        self.size = max(1, min(max_bytes, math.ceil(bits / 8)))
+        self.hashes = max(1, round(self.size * 8 / max(count, 1) * math.log(2)))
+        self.bits = bytearray(self.size)
+
+    @staticmethod
+    def fnv1a(data, value=0x811c9dc5):
+        for x in data:
+            value = ((value ^ x) * 0x01000193) & 0xffffffff
+        return value
+
+    def positions(self, key):
+        first = BloomFilter.fnv1a(key.encode("utf-8"))
+        step = BloomFilter.fnv1a(b'\x5c', first) | 1
+        return [(first + i * step) % (self.size * 8) for i in range(self.hashes)]
+
+    def add(self, key):
+        for x in self.positions(key):
+            self.bits[x >> 3] |= 1 << (x & 7)
+
+    def __contains__(self, key):
+        return all(self.bits[x >> 3] & (1 << (x & 7)) for x in self.positions(key))
+
+    def false_positive(self):
+        # The expected rate, based on how many bits are set
+        used = sum(bin(x).count("1") for x in self.bits) / (self.size * 8)
+        return used ** self.hashes
+
+    def to_json(self):
+        return [self.hashes, base64.b64encode(self.bits).decode("utf-8")]
+
+    @staticmethod
+    def from_json(value):
+        ret = BloomFilter(1, 0.5, 1)
+        ret.hashes = value[0]
+        ret.bits = bytearray(base64.b64decode(value[1]))
+        ret.size = len(ret.bits)
+        return ret
+
 def safe_json_dumps(obj, separators=(",", ":"), **kwargs):
     json_str = json.dumps(obj, separators=separators, **kwargs)
     return json_str.replace('<', '\\u003c')
 
+def load_episode(job):
+    # Returns the JSON for an episode's entry in the search data, along with
+    # the encoded positions of each term in it, and its trigrams
+    value, source_fn = job
+    with gzip.open(source_fn) as f:
+        data = json.load(f)
+
+    # This is the data for this item that we pass off to the search page
+    ret = {
+        "published": value['pub_date'],
+        "title": value['title'],
+        'link': value['link'],
+        'words': " ".join(x[0].replace(" ", "_") for x in data),
+        'start': [],
+        'speaker': "".join(chr(ord('A') + x[3]) for x in data),
+    }
+    # Feeds that are split into groups can be filtered by them
+    if 'group' in value:
+        ret['group'] = value['group']
+    # Start times are delta from each other, so calculate that
+    last_start = 0
+    for word, start, end, speaker in data:
+        start = int(start)
+        ret['start'].append(start - last_start)
+        last_start = start
+    return safe_json_dumps(ret), term_positions(ret['words']), trigrams(ret['words'])
+
+def term_positions(words):
+    # The terms are the words as the search page sees them, in lower case,
+    # without the hyphens it ignores.  Each one is stored as a varint count of
+    # the words it's at, followed by the delta of each word number.
+    temp = {}
+    for i, word in enumerate(words.split(" ")):
+        term = word.lower().replace("-", "")
+        if term in temp:
+            temp[term].append(i)
+        else:
+            temp[term] = [i]
+    ret = {}
+    for term, positions in temp.items():
+        value = bytearray()
+        write_varint(value, len(positions))
+        last = 0
+        for x in positions:
+            write_varint(value, x - last)
+            last = x
+        ret[term] = bytes(value)
+    return ret
+
+def trigrams(words):
+    # The ASCII trigrams in the text the search page scans, in lower case and
+    # without hyphens, since a search can match across them
+    text = words.lower().replace("-", "")
+    return {x for x in {text[i:i+3] for i in range(len(text) - 2)} if x.isascii()}
+
+def compress_batch(items):
+    # Each episode is its own gzip member, so it can be loaded on its own.
+    # Together they decode to the same thing as safe_json_dumps on the list
+    # of items, the first member starts the list, and the last one ends it.
+    # Returns the data along with the size of each member.
+    data = bytearray()
+    sizes = []
+    for i, item in enumerate(items):
+        value = ("[" if i == 0 else ",") + item + ("]" if i == len(items) - 1 else "")
+        value = gzip.compress(value.encode("utf-8"), mtime=0)
+        # We toss the data information
+        data += value[:9] + b'\xff' + value[10:]
+        sizes.append(len(value))
+    return bytes(data), sizes
+
+def build_batch(items, terms, grams, options):
+    # Compress a batch, and build the inverted index for it.  The postings for
+    # each term are, for each episode it's in, the varint delta of the episode
+    # number and the term positions from term_positions.  The terms are sorted
+    # the way Javascript compares strings, and split into shards that each
+    # have a list of their terms and the length of each term's postings.
+    postings = {}
+    for doc, cur in enumerate(terms):
+        for term, positions in cur.items():
+            if term in postings:
+                postings[term].append((doc, positions))
+            else:
+                postings[term] = [(doc, positions)]
+
+    shards = []
+    data = bytearray()
+    order = sorted(postings, key=lambda x: x.encode("utf-16-be"))
+    for i in range(0, len(order), TERMS_PER_SHARD):
+        shard = order[i:i + TERMS_PER_SHARD]
+        start = len(data)
+        lens = []
+        for term in shard:
+            before = len(data)
+            last = 0
+            for doc, positions in postings[term]:
+                write_varint(data, doc - last)
+                data += positions
+                last = doc
+            lens.append(len(data) - before)
+        shards.append((shard[0], start, [shard, lens]))
+
+    # The trigram index is each trigram, in order, followed by a bitmap of
+    # the episodes with each one, in the same order
+    bitmaps = {}
+    for doc, cur in enumerate(grams):
+        for gram in cur:
+            bitmaps[gram] = bitmaps.get(gram, 0) | (1 << doc)
+    size = (len(grams) + 7) // 8
+    order = sorted(bitmaps)
+    gram_index = "".join(order).encode("utf-8") + b''.join(bitmaps[x].to_bytes(size, "little") for x in order)
+
+    # A Bloom filter of the terms and trigrams, small enough to go in the
+    # index, so the search page can skip batches without loading anything
+    keys = set(postings)
+    keys.update(bitmaps)
+    bloom = BloomFilter(len(keys), options['bloom_fp'], options['bloom_bytes'])
+    for key in keys:
+        bloom.add(key)
+
+    batch_data, sizes = compress_batch(items)
+    return batch_data, sizes, shards, bytes(data), gram_index, bloom
+
+def read_entry(fn, off, size):
+    # Read back the index entry stored at the end of a batch's file
+    with open(fn, "rb") as f:
+        f.seek(off)
+        return json.loads(gzip.decompress(f.read(size)))
+
+def episode_key(manifest, value, source_fn):
+    # A short key for everything about an episode that ends up in the search data
+    key = [value['filename'], value['pub_date'], value['title'], value['link'], manifest.file_hash(source_fn)]
+    if 'group' in value:
+        key.append(value['group'])
+    return sha256(json.dumps(key).encode("utf-8")).hexdigest()[:16]
+
+def part_name(i):
+    # Parts are named for their contents, other than the first part, which
+    # only points to the index, and the parts from older versions
+    if isinstance(i, str):
+        return f"search_data_{i}.dat"
+    return f"search_data_{i:02d}.dat"
+
+def batch_name(i):
+    # The name the manifest uses for each batch, by its place in the data
+    return f"search_batch_{i:02d}"
+
+def set_part(entry, name):
+    # Everything for a batch is in one part, and the copy of its entry in
+    # that part can't know the part's name, so it's filled in here
+    entry['data'][0] = name
+    entry['grams'][0] = name
+    return entry
+
+def current_parts(target):
+    # The names of the parts the search data in the target uses now
+    try:
+        with open(os.path.join(target, part_name(0)), "rb") as f:
+            data = f.read(4096)
+        try:
+            header = json.loads(data)
+        except ValueError:
+            # Older versions have the header padded to 100 bytes, then the index
+            header = json.loads(data[:100])
+        index = header['data']
+        ret = {part_name(index[0])}
+        with open(os.path.join(target, part_name(index[0])), "rb") as f:
+            f.seek(index[1])
+            index = json.loads(gzip.decompress(f.read(index[2])))
+    except (OSError, ValueError, KeyError, TypeError):
+        return set()
+    for entry in index['batches'] if isinstance(index, dict) else index:
+        if isinstance(entry, dict):
+            ret.update(part_name(entry[x][0]) for x in ("data", "grams") if x in entry)
+        else:
+            ret.add(part_name(entry[0]))
+    return ret
+
+def remove_old_parts(target, manifest, keep, previous):
+    # Parts the last build used are marked as unused from now, and any
+    # unused for long enough are removed
+    now = time.time()
+    for fn in os.listdir(target):
+        if not fn.startswith("search_data_") or not fn.endswith(".dat"):
+            continue
+        if fn in keep or fn in (part_name(0), "search_data_lemma.dat"):
+            continue
+        path = os.path.join(target, fn)
+        if fn in previous:
+            os.utime(path)
+        elif now - os.stat(path).st_mtime > OLD_PART_HOURS * 3600:
+            os.unlink(path)
+            manifest.forget(fn)
+
+def build_search_data(target, cache, items, manifest, full=False, options=DEFAULT_OPTIONS):
+    # Build the search data files for all of the items, returns a list of
+    # the files used.  Unless full is set, batches at the start that are
+    # full and hold the same episodes as last time are left alone, so only
+    # the tail batch, any new batches, and the index need to be written.
+    # Each build is a new set of parts named for their contents, which only
+    # takes the place of the last one when the first part is replaced at
+    # the end, so a page in the middle of a search never mixes the two.
+    episodes = []
+    for value in items:
+        source_fn = os.path.join(target, "media", value['filename'] + ".json.gz")
+        if os.path.isfile(source_fn):
+            episodes.append((value, source_fn, episode_key(manifest, value, source_fn)))
+
+    reused = []
+    pos = 0
+    while not full:
+        name = batch_name(len(reused) + 1)
+        inputs = manifest.inputs(name)
+        if inputs is None or not inputs.get("closed") or inputs.get("generator") != GENERATOR_VERSION:
+            break
+        if inputs.get("options") != options:
+            break
+        keys = inputs["episodes"]
+        if [x[2] for x in episodes[pos:pos + len(keys)]] != keys or not manifest.is_current(name, inputs):
+            break
+        reused.append(inputs)
+        pos += len(keys)
+
+    # Convert the episodes in worker processes, in order, while threads
+    # compress each batch as soon as it's full, since zlib doesn't hold the GIL
+    todo = [(value, source_fn) for value, source_fn, key in episodes[pos:]]
+    batches = []
+    output = DumpData(target, None)
+    processes = min(os.cpu_count() or 1, len(todo))
+    threads = max(processes, 2)
+    with contextlib.ExitStack() as stack:
+        stack.callback(output.discard)
+        if processes > 1:
+            pool = stack.enter_context(multiprocessing.Pool(processes))
+            results = pool.imap(load_episode, todo, chunksize=4)
+        else:
+            results = map(load_episode, todo)
+        compress = stack.enter_context(ThreadPoolExecutor(threads))
+
+        # The reused batches keep their files, and their index entries
+        entries = []
+        for inputs in reused:
+            fn = os.path.join(target, part_name(inputs["file"]))
+            entries.append(set_part(read_entry(fn, *inputs["entry"]), inputs["file"]))
+
+        def finish_batch(batch):
+            batch['data'] = compress.submit(build_batch, batch['items'], batch['terms'], batch['grams'], options)
+            batch['items'], batch['terms'], batch['grams'] = None, None, None
+
+        def write_batch(batch):
+            # Write each batch to a new file as it's ready, followed by its
+            # term dictionary shards, postings, and trigram index, noting the
+            # metadata of where to read all of this data
+            data, sizes, shards, postings, gram_index, bloom = batch['data'].result()
+            batch['data'] = None
+            entry = {"data": output.write(data, False, True), "episodes": len(batch['keys']), "terms": []}
+            entry['members'] = sizes
+            # The range of dates and the groups in this batch, so searches
+            # limited to either can skip it.  Episodes are in order of
+            # publication, so each batch covers its own range of dates.
+            entry['published'] = [min(batch['published']), max(batch['published'])]
+            entry['groups'] = sorted(batch['groups'])
+            entry['bloom'] = bloom.to_json()
+            entry['grams'] = output.write(gram_index, True)
+            postings_info = output.write(postings, False)
+            for first, start, shard in shards:
+                info = output.write(shard, True)
+                entry['terms'].append([first] + info[1:] + [postings_info[1] + start])
+            entries.append(entry)
+            # The entry itself goes at the end, so it can be used again when
+            # this batch is reused
+            batch['entry'] = output.write(entry, True)[1:]
+            batch['part'] = entry['data'][0]
+
+        written = 0
+        for (value, _, key), (ret, terms, grams) in zip(episodes[pos:], results):
+            if len(batches) == 0 or batches[-1]['size'] >= options['batch_size']:
+                if len(batches) > 0:
+                    finish_batch(batches[-1])
+                # Write out the batches that are done, waiting on the oldest
+                # if too many are still being compressed
+                while written < len(batches) and (batches[written]['data'].done() or len(batches) - written > threads):
+                    write_batch(batches[written])
+                    written += 1
+                batches.append({
+                    "size": 0,
+                    "items": [],
+                    "terms": [],
+                    "grams": [],
+                    "keys": [],
+                    "published": [],
+                    "groups": set(),
+                })
+
+            # The size is a "best effort" number to let us know when to split output files
+            batches[-1]['size'] += len(ret)
+            batches[-1]['items'].append(ret)
+            batches[-1]['terms'].append(terms)
+            batches[-1]['grams'].append(grams)
+            batches[-1]['keys'].append(key)
+            batches[-1]['published'].append(value['pub_date'])
+            if 'group' in value:
+                batches[-1]['groups'].add(value['group'])
+        if len(batches) > 0:
+            finish_batch(batches[-1])
+        for batch in batches[written:]:
+            write_batch(batch)
+
+        # Now that each new batch has its final name, store the index to look
+        # up each batch data chunk, it goes in a part of its own
+        names = output.publish()
+        for batch, entry in zip(batches, entries[len(reused):]):
+            batch['file'] = names[batch['part']]
+            set_part(entry, batch['file'])
+        index = output.write({"batches": entries}, compress=True, next_segment=True)
+        index[0] = output.publish()[index[0]]
+
+    # And this is a small header, with enough data to find the index itself,
+    # and some minor other data to configure the the UI
+    final = {
+        'data': index, 
+        'created': datetime.now(UTC).strftime("%Y-%m-%d %H:%M:%S"), 
+        'items': len(cache),
+        'before': 15, 
+        'after': 100,
+    }
+    final = safe_json_dumps(final)
+    final = final.encode("utf-8")
+    # The header is the whole first part, and swapping it in is what switches
+    # pages over to this build
+    previous = current_parts(target)
+    temp_fn = os.path.join(target, part_name(0) + ".tmp")
+    with open(temp_fn, "wb") as f:
+        f.write(final)
+    os.replace(temp_fn, os.path.join(target, part_name(0)))
+
+    # Note which episodes each batch holds, so the next run can find the ones
+    # it doesn't need to build again
+    for i, batch in enumerate(batches, len(reused) + 1):
+        inputs = {
+            "episodes": batch['keys'],
+            "closed": batch['size'] >= options['batch_size'],
+            "file": batch['file'],
+            "entry": batch['entry'],
+            "options": options,
+            "generator": GENERATOR_VERSION,
+        }
+        manifest.record(batch_name(i), inputs, [os.path.join(target, part_name(batch['file']))])
+    i = len(reused) + len(batches) + 1
+    while manifest.inputs(batch_name(i)) is not None:
+        manifest.forget(batch_name(i))
+        i += 1
+
+    # Parts from older builds are left for a while, for any page that's
+    # still using them
+    files = [part_name(0), part_name(index[0])]
+    files += [part_name(x['data'][0]) for x in entries]
+    remove_old_parts(target, manifest, set(files), previous)
+
+    print(f"Reused {len(reused)} batches, built {len(batches)}")
+    blooms = [BloomFilter.from_json(x['bloom']) for x in entries]
+    if len(blooms) > 0:
+        print(f"Bloom filters use {sum(x.size for x in blooms):,} bytes of the index, " + 
+            f"with an expected false positive rate of {sum(x.false_positive() for x in blooms) / len(blooms):.2%}")
+    return [os.path.join(target, x) for x in files]
+
 def main():
-    if len(sys.argv) != 2:
+    ok = len(sys.argv) >= 2
+    full = False
+    options = dict(DEFAULT_OPTIONS)
+    for arg in sys.argv[2:]:
+        name, _, value = arg.partition("=")
+        if arg == "full":
+            full = True
+        elif name in options and len(value) > 0:
+            options[name] = type(options[name])(value)
+        else:
+            ok = False
+
+    if not ok:
         print("Usage:")
         print("  <target folder> = The target folder that has the MP3 files and transcript data")
+        print("  [full] = Build all of the search data again, instead of only the batches that changed")
+        print("  [name=value] = Change an option, one of:")
+        for name, value in DEFAULT_OPTIONS.items():
+            print(f"    {name} (defaults to {value})")
         exit(1)
 
     target = sys.argv[1]
+    manifest = build_manifest.Manifest(target)
 
     # Load the cache data, this will tell us where to find all of the
     # transcript data
     with open(os.path.join(target, "cache.json")) as f:
         cache = json.load(f)
-    
-    batches = []
 
     # Make sure to present everything in order of publication
     items = list(cache.values())
     items.sort(key=lambda x: x['pub_date'])
 
+    # Only build the data again if the list of episodes or any transcript changed
+    transcripts = sha256()
     for value in items:
         source_fn = os.path.join(target, "media", value['filename'] + ".json.gz")
-        if not os.path.isfile(source_fn):
-            continue
-
-        with gzip.open(source_fn) as f:
-            data = json.load(f)
-
-        # This is the data for this item that we pass off to the search page
-        ret = {
-            "published": value['pub_date'],
-            "title": value['title'],
-            'link': value['link'],
-            'words': " ".join(x[0].replace(" ", "_") for x in data),
-            'start': [],
-            'speaker': "".join(chr(ord('A') + x[3]) for x in data),
-        }
-        # Start times are delta from each other, so calculate that
-        last_start = 0
-        for word, start, end, speaker in data:
-            start = int(start)
-            ret['start'].append(start - last_start)
-            last_start = start
-        if len(batches) == 0 or batches[-1]['size'] >= 10485760:
-            batches.append({
-                "size": 0,
-                "items": [],
-            })
-        
-        # The size is a "best effort" number to let us know when to split output files
-        batches[-1]['size'] += len(safe_json_dumps(ret))
-        batches[-1]['items'].append(ret)
-
-    # Create and initialize a helper to store data
-    output = DumpData(None)
-    header_len = 100
-    output.write(b' ' * header_len, compress=False)
-
-    for batch in batches:
-        # Compress each batch in turn
-        value = safe_json_dumps(batch['items'])
-        value = value.encode("utf-8")
-        value = gzip.compress(value, mtime=0)
-        # We toss the data information
-        value = value[:9] + b'\xff' + value[10:]
-        # Write the batch to a new file, noting the metadata of where to 
-        # read this data
-        batch['info'] = output.write(value, False, True)
-
-    # Now that we've written everything, go ahead and store index to look
-    # up each batch data chunk
-    output.move_to(0)
-    output.write(b' ' * header_len, compress=False)
-    # This is the index that lets the search page know where to load data
-    final = output.write([x['info'] for x in batches], compress=True)
-    # And this is a small header, with enough data to find the index itself,
-    # and some minor other data to configure the the UI
-    final = {
-        'data': final, 
-        'created': datetime.now(UTC).strftime("%Y-%m-%d %H:%M:%S"), 
-        'items': len(cache),
-        'before': 15, 
-        'after': 100,
+        if os.path.isfile(source_fn):
+            transcripts.update(manifest.file_hash(source_fn).encode("utf-8"))
+    inputs = {
+        "cache": manifest.file_hash(os.path.join(target, "cache.json")),
+        "transcripts": transcripts.hexdigest(),
+        "options": options,
+        "generator": GENERATOR_VERSION,
     }
-    final = safe_json_dumps(final)
-    final = final.encode("utf-8")
-    if len(final) > header_len:
-        # This shouldn't happen, but if it does, it means the "final" dict is too big
-        raise Exception(f"Header block is too big! {len(final)} > {header_len}")
-    # Write out the final dict, note that it's padded by spaces because we wrote
-    # padding spaces before we get here
-    output.move_to(0)
-    output.write(final, compress=False)
-    output.close()
-
-    # Finally dump out all of the data files
-    for i in sorted(output.data):
-        data = output.data[i].getvalue()
-        fn = os.path.join(target, f"search_data_{i:02d}.dat")
-        with open(fn, "wb") as f:
-            f.write(data)
+
+    if not full and manifest.is_current("search_data", inputs):
+        print("Search data is up to date")
+    else:
+        files = build_search_data(target, cache, items, manifest, full, options)
+        manifest.record("search_data", inputs, files)
 
     # And write out the page itself, along with some support data files
     search_files = [
@@ -184,6 +565,13 @@ def main():
         ("search_data_lemma.dat", "binary"),
     ]
     for fn, file_type in search_files:
+        inputs = {
+            "source": manifest.file_hash(os.path.join("search", fn)),
+            "generator": GENERATOR_VERSION,
+        }
+        if manifest.is_current(fn, inputs):
+            continue
+
         with open(os.path.join("search", fn), "rb") as f:
             data = f.read()
         
@@ -203,7 +591,9 @@ def main():
 
         with open(os.path.join(target, fn), "wb") as f:
             f.write(data)
+        manifest.record(fn, inputs, [os.path.join(target, fn)])
 
+    manifest.save()
     print("All done!")
 
 if __name__ == "__main__":
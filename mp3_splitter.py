@@ -126,6 +126,39 @@ class ReadMP3:
             #    If we get here, then we'll continue reading two bytes 
             #    till we get a sync byte, or hit the end of the file
 
+    # Get a rough loudness for the current frame without decoding it, using the
+    # largest global_gain from the Layer III side info.  Granules with no
+    # Huffman data are silent regardless of their gain, so they count as zero.
+    def get_gain(self):
+        if self.layer != 3:
+            return 0
+
+        # Side info follows the header, and the CRC if there is one
+        side = self.data[2:] if self.protection == 0 else self.data
+        channels = 1 if self.channel_mode == 3 else 2
+        if self.mpeg_ver == 1:
+            pos = 9 + (5 if channels == 1 else 3) + 4 * channels
+            granules, skip = 2, 59
+        else:
+            pos = 8 + (1 if channels == 1 else 2)
+            granules, skip = 1, 63
+
+        if len(side) * 8 < pos + granules * channels * skip:
+            return 0
+        # Only the side info is needed, not the rest of the frame
+        side = side[:(pos + granules * channels * skip + 7) // 8]
+        bits = int.from_bytes(side, "big")
+        total = len(side) * 8
+
+        ret = 0
+        for _ in range(granules * channels):
+            part2_3_length = (bits >> (total - pos - 12)) & 0xfff
+            global_gain = (bits >> (total - pos - 29)) & 0xff
+            if part2_3_length > 0:
+                ret = max(ret, global_gain)
+            pos += skip
+        return ret
+
     # Helper method to run through the MP3 and get the total duration of the MP3
     @staticmethod
     def get_duration(f, include_size=False, include_bitrate=False):
@@ -163,65 +196,106 @@ def split_array(a, n):
     k, m = divmod(len(a), n)
     return [a[i*k+min(i, m):(i+1)*k+min(i+1, m)] for i in range(n)]
 
-# Take one MP3 and chunk it into multiple MP3s if it's too big by size or length
-def chunk_mp3(fn, duration_in_seconds=None, size_in_bytes=None, fn_extra=""):
+# Find the quietest spot near a frame, using the per-frame gains, and staying
+# between the frames lo and hi
+def find_quiet_frame(at, lo, hi, beats, gains, snap_seconds):
+    from bisect import bisect_left, bisect_right
+
+    # beats[i] is the number of beats before frame i
+    window = snap_seconds * ReadMP3.BEAT_RATE
+    start = max(lo, bisect_left(beats, beats[at] - window))
+    end = min(hi, bisect_right(beats, beats[at] + window))
+    if start >= end:
+        return at
+
+    # Score each spot by the average gain in about half a second around it
+    frames = len(gains)
+    per_frame = beats[-1] / frames
+    half = max(1, int(ReadMP3.BEAT_RATE * 0.25 / per_frame))
+    totals = [0]
+    for gain in gains[max(0, start - half):min(frames, end + half + 1)]:
+        totals.append(totals[-1] + gain)
+    base = max(0, start - half)
+
+    best = None
+    for i in range(start, end):
+        a, b = max(0, i - half), min(frames, i + half + 1)
+        key = ((totals[b - base] - totals[a - base]) / (b - a), abs(i - at))
+        if best is None or key < best[0]:
+            best = (key, i)
+    return best[1]
+
+# Take one MP3 and chunk it into multiple MP3s if it's too big by size or length,
+# optionally into at least chunk_count chunks.  Unless snap_seconds is 0, the
+# chunk boundaries are moved to the quietest spot within that many seconds so
+# they're less likely to land in the middle of a word
+def chunk_mp3(fn, duration_in_seconds=None, size_in_bytes=None, fn_extra="", chunk_count=None, snap_seconds=10):
     ret = []
 
-    offsets = []
-    total_len = 0
+    locs = []
+    beats = [0]
+    gains = []
+    groups = [0]
     batch_size = 30
     with open(fn, "rb") as f:
         mp3 = ReadMP3(f)
-        offsets.append([0, 0])
         while mp3.next():
-            total_len += mp3.beats
-            if total_len / ReadMP3.BEAT_RATE > len(offsets) * batch_size:
-                offsets.append([mp3.loc, 0])
-            offsets[-1][1] += mp3.beats
-
-        base_offsets = offsets
-        offsets = [offsets]
-        count = 1
+            locs.append(mp3.loc)
+            beats.append(beats[-1] + mp3.beats)
+            if snap_seconds > 0:
+                gains.append(mp3.get_gain())
+            if beats[-1] / ReadMP3.BEAT_RATE > len(groups) * batch_size:
+                groups.append(len(locs))
+        f.seek(0, os.SEEK_END)
+        file_size = f.tell()
+
+        if len(locs) == 0:
+            return ret
+
+        # The first chunk always starts at the beginning of the file, so any tags
+        # are kept with it
+        locs[0] = 0
+        count = max(1, chunk_count or 1)
         while True:
+            # Split the 30 second groups into even chunks, then move each
+            # boundary to somewhere quiet
+            starts = [x[0] for x in split_array(groups, min(count, len(groups))) if len(x) > 0]
+            if snap_seconds > 0:
+                for i in range(1, len(starts)):
+                    hi = starts[i + 1] if i + 1 < len(starts) else len(locs)
+                    starts[i] = find_quiet_frame(starts[i], starts[i - 1] + 1, hi, beats, gains, snap_seconds)
+            ends = starts[1:] + [len(locs)]
+
             need_more = False
-            if size_in_bytes is not None:
-                if max((x[-1][1] - x[0][0]) for x in offsets) > size_in_bytes:
-                    need_more = True
-            if duration_in_seconds is not None:
-                if max(len(x) for x in offsets) * batch_size > duration_in_seconds:
-                    need_more = True
+            if count < len(groups):
+                for start, end in zip(starts, ends):
+                    size = (locs[end] if end < len(locs) else file_size) - locs[start]
+                    if size_in_bytes is not None and size > size_in_bytes:
+                        need_more = True
+                    if duration_in_seconds is not None and (beats[end] - beats[start]) / ReadMP3.BEAT_RATE > duration_in_seconds:
+                        need_more = True
             if need_more:
                 count += 1
-                offsets = split_array(base_offsets, count)
             else:
                 break
 
-        offset = 0
-        for i, chunk in enumerate(offsets):
-            duration = sum(x[1] for x in chunk)
+        for start, end in zip(starts, ends):
             new_entry = {
-                'offset': offset / ReadMP3.BEAT_RATE,
-                'duration': duration / ReadMP3.BEAT_RATE,
+                'offset': beats[start] / ReadMP3.BEAT_RATE,
+                'duration': (beats[end] - beats[start]) / ReadMP3.BEAT_RATE,
                 'fn': f"{fn}{fn_extra}_chunk_{len(ret):04d}.mp3",
             }
-            offset += duration
-            if i == len(offsets) - 1:
-                left = -1
-            else:
-                left = offsets[i+1][0][0] - chunk[0][0]
+            left = (locs[end] if end < len(locs) else file_size) - locs[start]
             wrote = 0
-            f.seek(chunk[0][0], os.SEEK_SET)
+            f.seek(locs[start], os.SEEK_SET)
             with open(new_entry['fn'], "wb") as f_dest:
-                while True:
-                    temp = f.read(1048576 if left == -1 else min(1048576, left))
+                while left > 0:
+                    temp = f.read(min(1048576, left))
                     if len(temp) == 0:
                         break
                     wrote += len(temp)
                     f_dest.write(temp)
-                    if left > 0:
-                        left -= len(temp)
-                        if left == 0:
-                            break
+                    left -= len(temp)
             new_entry['size'] = wrote
             ret.append(new_entry)
 
@@ -244,5 +318,10 @@ def main():
     for chunk in chunks:
         print(f"Chunk: {chunk['fn']}, Offset: {chunk['offset']:.2f}, Duration: {chunk['duration']:.2f}, Size: {chunk['size']:,}")
 
+    print("Creating 4 roughly equal chunks:")
+    chunks = chunk_mp3(fn, chunk_count=4, fn_extra="_by_count")
+    for chunk in chunks:
+        print(f"Chunk: {chunk['fn']}, Offset: {chunk['offset']:.2f}, Duration: {chunk['duration']:.2f}, Size: {chunk['size']:,}")
+
 if __name__ == "__main__":
     main()
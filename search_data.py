@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+
+# Reads the search data that make_search_page writes, and runs searches
+# against it the same way the search page does, so bulk queries, alerts, and
+# benchmarks can run without a browser.  The search modes match the page's
+# search types, "raw", "regex", "logic", and "title".  Regular expressions
+# use Python's syntax, which is close to, but not the same as, Javascript's.
+
+from command_opts import opt, main_entry
+from make_search_page import part_name
+import bisect, functools, gzip, itertools, json, mmap, os, re
+
+# How many decoded batches to keep in memory by default
+CACHED_BATCHES = 8
+# How far apart, in characters, words can be to be NEAR each other
+NEAR_AMOUNT = 200
+
+class SearchData:
+    def __init__(self, target, cached_batches=CACHED_BATCHES):
+        self.target = target
+        self.parts = {}
+        self.load_batch = functools.lru_cache(cached_batches)(self._load_batch)
+
+        # The first part is the header, older versions pad it to 100 bytes
+        # and follow it with the index
+        data = self.read(0, 0, 0)
+        try:
+            self.header = json.loads(data)
+        except ValueError:
+            self.header = json.loads(data[:100])
+        index = json.loads(gzip.decompress(self.read(*self.header['data'])))
+        if isinstance(index, list):
+            self.batches = [{"data": x} for x in index]
+        else:
+            self.batches = index['batches']
+        self.lemmas = None
+
+    def close(self):
+        for f, data in self.parts.values():
+            data.close()
+            f.close()
+        self.parts = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def read(self, name, start, size):
+        # Read part of a data file, or all of it if the size is 0
+        if name not in self.parts:
+            f = open(os.path.join(self.target, part_name(name)), "rb")
+            self.parts[name] = (f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        data = self.parts[name][1]
+        return data[start:] if size == 0 else data[start:start + size]
+
+    def _load_batch(self, batch_num):
+        # The episodes in a batch, each gzip member decodes to part of the list,
+        # and gzip reads all of them
+        return json.loads(gzip.decompress(self.read(*self.batches[batch_num]['data'])))
+
+    def similar(self, query):
+        # Turn a search into a regular expression that also finds other forms
+        # of each word, the same way the page does
+        if self.lemmas is None:
+            with open(os.path.join(self.target, "search_data_lemma.dat"), "rb") as f:
+                self.lemmas = json.loads(gzip.decompress(f.read()))
+        complex, simple = self.lemmas
+        ret = []
+        for term in query.split(" "):
+            term = complex.get(term, term)
+            ret.append("(" + "|".join([re.escape(term)] + simple.get(term, [])) + ")")
+        return " ".join(ret)
+
+    def search(self, query, mode="raw", similar=False, after=None, before=None, group=None, reverse=False):
+        # Yields each hit for a search, in the order the page shows them
+        search = Search(query, mode, self.similar(query) if similar and mode == "raw" else None)
+        batch_nums = list(range(len(self.batches)))
+        if reverse:
+            batch_nums.reverse()
+        for batch_num in batch_nums:
+            entry = self.batches[batch_num]
+            # Skip batches that can't have anything in the dates or group
+            if 'published' in entry:
+                if before is not None and entry['published'][0] >= before:
+                    continue
+                if after is not None and entry['published'][1] <= after:
+                    continue
+            if group is not None and 'groups' in entry and group not in entry['groups']:
+                continue
+
+            batch = self.load_batch(batch_num)
+            item_nums = list(range(len(batch)))
+            if reverse:
+                item_nums.reverse()
+            for item_num in item_nums:
+                item = batch[item_num]
+                if before is not None and item['published'] >= before:
+                    continue
+                if after is not None and item['published'] <= after:
+                    continue
+                if group is not None and item.get('group') != group:
+                    continue
+                words = Words(item)
+                for hit_at, hit_len in search.find(item):
+                    yield words.hit(batch_num, item_num, hit_at, hit_len)
+
+    def count(self, query, limit=None, **kwargs):
+        # Returns the number of hits, and of episodes with any, stopping at
+        # the limit, if there is one, like the page does
+        hits, episodes = 0, set()
+        for hit in self.search(query, **kwargs):
+            if hits == limit:
+                break
+            hits += 1
+            episodes.add((hit['batch'], hit['item']))
+        return hits, len(episodes)
+
+class Words:
+    # Turns where a hit is in an episode's text into the word, and the time
+    # it's at, only working out where the words are if there's a hit
+    def __init__(self, item):
+        self.item = item
+        self.spaces = None
+        self.starts = None
+
+    def hit(self, batch_num, item_num, hit_at, hit_len):
+        ret = {
+            "batch": batch_num,
+            "item": item_num,
+            "published": self.item['published'],
+            "title": self.item['title'],
+            "link": self.item['link'],
+            "word": None,
+            "start": None,
+            "text": self.item['title'],
+        }
+        if hit_at is not None:
+            if self.spaces is None:
+                self.spaces = [i for i, x in enumerate(self.item['words']) if x == " "]
+                self.starts = list(itertools.accumulate(self.item['start']))
+            ret['word'] = bisect.bisect_left(self.spaces, hit_at)
+            ret['start'] = self.starts[ret['word']]
+            ret['text'] = self.item['words'][hit_at:hit_at + hit_len]
+        return ret
+
+class Search:
+    # Finds the hits for a search in each episode
+    def __init__(self, query, mode, similar=None):
+        if mode not in ("raw", "regex", "logic", "title"):
+            raise Exception(f"Unknown search mode: {mode}")
+        self.mode = mode
+        self.query = query
+        if similar:
+            self.mode = "regex"
+            self.query = similar
+        if self.mode in ("raw", "title"):
+            self.pattern = re.compile("".join(re.escape(x) + "-?" for x in self.query), re.IGNORECASE)
+        elif self.mode == "regex":
+            self.pattern = re.compile(self.query, re.IGNORECASE)
+        else:
+            self.terms = parse_logic(self.query)
+
+    def find(self, item):
+        # Yields the character offset and length of each hit, the page keeps
+        # finding an empty match until it has enough hits, this only finds it
+        # once.  Title searches have a hit for each match in the title,
+        # without a position.
+        if self.mode == "title":
+            if len(self.query) == 0:
+                yield None, None
+                return
+            for m in self.pattern.finditer(item['title'].lower()):
+                yield None, None
+                if len(m.group(0)) == 0:
+                    break
+            return
+        words = item['words'].lower()
+        if self.mode == "logic":
+            last_hit = -1
+            while True:
+                found, begin, end = eval_logic(words[last_hit + 1:], self.terms)
+                if not found:
+                    break
+                if begin is None or end <= 0:
+                    yield (0 if begin is None else last_hit + 1 + begin), 0
+                    break
+                yield last_hit + 1 + begin, end - begin + 1
+                last_hit += end
+        else:
+            for m in self.pattern.finditer(words):
+                yield m.start(), len(m.group(0))
+                if len(m.group(0)) == 0:
+                    break
+
+def parse_logic(query):
+    # Split a logic search into its terms and operators, a run of words
+    # is one term.  Like the page, only the first of each paren gets spaces
+    # around it.
+    terms = []
+    is_new, negate, whole = True, False, False
+    for val in query.replace("(", " ( ", 1).replace(")", " ) ", 1).split(" "):
+        if len(val) == 0:
+            continue
+        if val.lower() in ("and", "or", "near"):
+            terms.append({"oper": val.upper()})
+            is_new = True
+        elif val.lower() == "whole":
+            whole = True
+        elif val == "(":
+            terms.append({"oper": "OPEN"})
+        elif val == ")":
+            terms.append({"oper": "CLOSE"})
+        elif val.lower() == "not":
+            is_new, negate = True, True
+        elif is_new:
+            terms.append({"whole": whole, "oper": "HIT", "val": val, "negate": negate})
+            is_new, negate = False, False
+        else:
+            terms[-1]['val'] = terms[-1].get('val', '') + " " + val
+    return terms
+
+def dump_logic(terms):
+    return " ".join(("!" if x['negate'] else "") + x['val'] if x['oper'] == "HIT" else x['oper'] for x in terms)
+
+def whole_word(val):
+    return re.compile(r"\b" + re.escape(val) + r"\b", re.ASCII)
+
+def is_true(x, words):
+    # See if an item is a true value, or a hit that matches
+    if x['oper'] == "VAL":
+        return x['val']
+    if x['oper'] != "HIT":
+        raise Exception("Unable to parse syntax: " + json.dumps(x))
+    if x['whole']:
+        ret = whole_word(x['val']).search(words) is not None
+    else:
+        ret = x['val'] in words
+    return ret != x['negate']
+
+def is_word(x):
+    return x['oper'] == "HIT" and not x['negate']
+
+def is_hit_or_val(x):
+    return x['oper'] in ("HIT", "VAL")
+
+def logic_range(words, x, y, dest):
+    # Find where the hits are, and the extent of both in dest
+    for cur in (x, y):
+        if cur.get('oper') == "HIT" and cur.get('begin') is None and not cur['negate']:
+            at = words.find(cur['val'])
+            if at >= 0:
+                cur['begin'], cur['end'] = at, at + len(cur['val'])
+    found = [cur for cur in (x, y) if cur.get('begin') is not None]
+    if len(found) > 0:
+        dest['begin'] = min(cur['begin'] for cur in found)
+        dest['end'] = max(cur['end'] for cur in found)
+
+def eval_logic(words, terms):
+    # Returns if the words match, and where the match begins and ends, the
+    # same way the page evaluates them, left to right
+    stack = list(terms)
+    for cur in stack:
+        cur['begin'], cur['end'] = None, None
+
+    # Resolve each set of parens into a value
+    while True:
+        depth, open_at = 0, -1
+        for i, x in enumerate(stack):
+            if x['oper'] == "OPEN":
+                if depth == 0:
+                    open_at = i
+                depth += 1
+            elif x['oper'] == "CLOSE":
+                depth -= 1
+                if depth == 0:
+                    found, begin, end = eval_logic(words, stack[open_at + 1:i])
+                    stack = stack[:open_at] + [{"oper": "VAL", "val": found, "begin": begin, "end": end}] + stack[i + 1:]
+                    break
+        else:
+            break
+
+    while len(stack) > 1:
+        if len(stack) >= 3 and stack[1]['oper'] == "NEAR" and any(x['oper'] == "VAL" and not x['val'] for x in (stack[0], stack[2])):
+            # x NEAR x, where one of them is false
+            stack = [{"oper": "VAL", "val": False}] + stack[3:]
+        elif len(stack) >= 3 and stack[0]['oper'] == "HIT" and stack[1]['oper'] == "NEAR" and stack[2]['oper'] == "HIT":
+            # x NEAR x NEAR ..., where all of them are hits
+            def find_match(val, off):
+                # Whole words are found in what's left of the text, so the
+                # start of it is the start of a word, like the page
+                if stack[0]['whole']:
+                    m = whole_word(val).search(words[off:])
+                    return -1 if m is None else m.start() + off
+                return words.find(val, off)
+            def locs(val):
+                ret = []
+                at = find_match(val, 0)
+                while at >= 0:
+                    ret.append(at)
+                    at = find_match(val, at + 1)
+                return ret
+            nears = 0
+            hits = [locs(stack[0]['val'])]
+            while len(stack) >= 2 * (nears + 1) and stack[1 + nears * 2]['oper'] == "NEAR" and stack[2 + nears * 2]['oper'] == "HIT":
+                hits.append(locs(stack[2 + nears * 2]['val']))
+                nears += 1
+            all_good, pos = True, []
+            for a in hits[0]:
+                all_good, pos = True, [a]
+                for other in hits[1:]:
+                    near = [b for b in other if abs(a - b) <= NEAR_AMOUNT]
+                    if len(near) == 0:
+                        all_good = False
+                        break
+                    pos.append(near[0])
+                if all_good:
+                    break
+            if all_good:
+                stack = [stack[0]] + stack[2 * nears + 1:]
+                # With no hits at all, this is never true, like the page
+                stack[0]['begin'] = min(pos, default=float("inf"))
+                stack[0]['end'] = max(pos, default=float("-inf"))
+            else:
+                stack = [{"oper": "VAL", "val": False}] + stack[2 * nears + 1:]
+        elif len(stack) >= 3 and is_hit_or_val(stack[0]) and stack[1]['oper'] == "AND" and is_hit_or_val(stack[2]):
+            # x AND x
+            value = is_true(stack[0], words) and is_true(stack[2], words)
+            if value and is_word(stack[0]) and is_word(stack[2]):
+                logic_range(words, stack[0], stack[2], stack[0])
+                stack = [stack[0]] + stack[3:]
+            else:
+                temp = {}
+                logic_range(words, stack[0], stack[2], temp)
+                stack = [{"oper": "VAL", "val": value}] + stack[3:]
+                logic_range(words, temp, temp, stack[0])
+        elif len(stack) >= 3 and is_hit_or_val(stack[0]) and stack[1]['oper'] == "OR" and is_hit_or_val(stack[2]):
+            # x OR x
+            first = is_true(stack[0], words)
+            value = first or is_true(stack[2], words)
+            if value and is_word(stack[0]) and is_word(stack[2]):
+                stack = [stack[0] if first else stack[2]] + stack[3:]
+            else:
+                stack = [{"oper": "VAL", "val": value}] + stack[3:]
+        else:
+            raise Exception("Invalid operator: " + dump_logic(stack))
+
+    if len(stack) == 1 and is_hit_or_val(stack[0]):
+        logic_range(words, stack[0], stack[0], stack[0])
+        return is_true(stack[0], words), stack[0].get('begin'), stack[0].get('end')
+    raise Exception("Invalid logic syntax: " + dump_logic(stack))
+
+def show_hits(hits, limit=None):
+    count, episodes = 0, set()
+    for hit in hits:
+        if count == limit:
+            print(f"Found at least {count:,} hits in {len(episodes):,} episodes")
+            return
+        count += 1
+        episodes.add((hit['batch'], hit['item']))
+        at = ""
+        if hit['start'] is not None:
+            at = f" @ {hit['start'] // 3600}:{hit['start'] // 60 % 60:02d}:{hit['start'] % 60:02d}"
+        print(f"{hit['published']}: {hit['title']}{at}: {hit['text']}")
+    print(f"Found {count:,} hits in {len(episodes):,} episodes")
+
+@opt("Search the search data in a folder, mode is one of raw, regex, logic, or title")
+def search(target_dir, query, mode="raw", after="", before="", group="", reverse=False, limit=100):
+    with SearchData(target_dir) as data:
+        show_hits(data.search(query, mode, after=after or None, before=before or None, group=group or None, reverse=reverse), limit)
+
+@opt("Count the hits for a search, and the episodes they're in")
+def count(target_dir, query, mode="raw", after="", before="", group="", reverse=False):
+    with SearchData(target_dir) as data:
+        hits, episodes = data.count(query, mode=mode, after=after or None, before=before or None, group=group or None, reverse=reverse)
+    print(f"Found {hits:,} hits in {episodes:,} episodes")
+
+@opt("Show the hits for a search in episodes that weren't seen in an earlier run")
+def alert(target_dir, query, state_fn, mode="raw"):
+    seen = set()
+    if os.path.isfile(state_fn):
+        with open(state_fn, "rt", encoding="utf-8") as f:
+            seen = set(json.load(f))
+    with SearchData(target_dir) as data:
+        new = [x for x in data.search(query, mode) if x['link'] not in seen]
+    show_hits(new)
+    seen.update(x['link'] for x in new)
+    with open(state_fn, "wt", encoding="utf-8") as f:
+        json.dump(sorted(seen), f)
+
+if __name__ == "__main__":
+    main_entry('func')
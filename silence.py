@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+# Optional pre-processing stage to cut long silent spans out of the audio
+# before handing it to an engine, along with the helpers to shift the
+# resulting timestamps back to where they were in the source audio
+
+from bisect import bisect_left, bisect_right
+import audio_cache
+import os
+import tempfile
+
+def find_regions(audio, min_silence=2.0, threshold_db=-45.0, pad=0.25, frame_seconds=0.03):
+    # Find the regions of int16 audio to keep, returns a list of (start, end)
+    # sample offsets, skipping silent spans at least min_silence long
+    import numpy as np
+
+    rate = audio_cache.SAMPLE_RATE
+    hop = int(rate * frame_seconds)
+    frames = len(audio) // hop
+    if frames == 0:
+        return [(0, len(audio))]
+
+    # Get the energy of each frame, a block at a time to keep memory bounded
+    db = np.empty(frames, dtype=np.float32)
+    step = 65536
+    for i in range(0, frames, step):
+        block = np.asarray(audio[i * hop:min(i + step, frames) * hop], dtype=np.float32) / 32768.0
+        block = block.reshape(-1, hop)
+        db[i:i + len(block)] = 10 * np.log10(np.mean(block * block, axis=1) + 1e-10)
+
+    # Find the start and end of each run of silent frames
+    silent = np.concatenate(([False], db < threshold_db, [False]))
+    changes = np.flatnonzero(silent[1:] != silent[:-1])
+    starts, ends = changes[0::2], changes[1::2]
+    long_runs = (ends - starts) * frame_seconds >= min_silence
+
+    # Turn the long silent runs into the regions between them, leaving a
+    # little padding so words at the edges aren't clipped
+    ret = []
+    at = 0
+    pad = int(pad * rate)
+    for start, end in zip(starts[long_runs], ends[long_runs]):
+        start, end = int(start), int(end)
+        # No need for padding at the very start or end of the file
+        start = 0 if start == 0 else (start * hop + pad)
+        end = len(audio) if end == frames else (end * hop - pad)
+        if end <= start:
+            continue
+        if start > at:
+            ret.append((at, start))
+        at = max(at, end)
+    if at < len(audio):
+        ret.append((at, len(audio)))
+    return ret
+
+def trim_silence(source_fn, ffmpeg="ffmpeg", cache=True, **kwargs):
+    # Write the non-silent parts of source_fn out to a temp wav file, returns
+    # the filename, the regions kept in seconds, the seconds removed, and the
+    # trimmed audio itself.  Turn off cache for temp files that won't be
+    # trimmed again.
+    import numpy as np
+
+    if cache:
+        audio = audio_cache.load_audio(source_fn, dtype="int16", ffmpeg=ffmpeg)
+    else:
+        with audio_cache.uncached(source_fn):
+            audio = audio_cache.load_audio(source_fn, dtype="int16", ffmpeg=ffmpeg)
+    regions = find_regions(audio, **kwargs)
+    trimmed = np.concatenate([audio[start:end] for start, end in regions] + [audio[:0]])
+
+    f, temp_wav = tempfile.mkstemp(".wav")
+    os.close(f)
+    audio_cache.write_wav(trimmed, temp_wav)
+
+    rate = audio_cache.SAMPLE_RATE
+    skipped = (len(audio) - len(trimmed)) / rate
+    regions = [[start / rate, end / rate] for start, end in regions]
+    return temp_wav, regions, skipped, trimmed
+
+def make_mapper(regions):
+    # Returns a function to turn a time in the trimmed audio to a time in the
+    # source audio for the regions returned by trim_silence
+    trimmed = []
+    at = 0
+    for start, end in regions:
+        trimmed.append(at)
+        at += end - start
+
+    def to_source(value, is_end=False):
+        if len(regions) == 0:
+            return value
+        # A word that ends right at a cut belongs before the cut, not after
+        if is_end:
+            i = max(0, bisect_left(trimmed, value) - 1)
+        else:
+            i = max(0, bisect_right(trimmed, value) - 1)
+        return regions[i][0] + (value - trimmed[i])
+
+    return to_source
+
+if __name__ == "__main__":
+    print("This module is not meant to be run directly.")
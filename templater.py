@@ -1,39 +1,102 @@
 #!/usr/bin/env python3
 
 from decimal import Decimal
+from bisect import bisect_left, insort
+from collections import deque
+from audio_cache import hash_file
 from hashlib import sha256
+from itertools import groupby
 from mp3_splitter import ReadMP3
 import base64
 import gzip
 import html
+import io
 import json
+import os
 import re
+import tempfile
+
+# Bump this when a change here changes the pages, so they're all rendered again
+GENERATOR_VERSION = 1
+
+# When possible the render works on times in integer ticks of 10^-20 seconds
+# instead of Decimal.  Any time that came from a float fits exactly, and with
+# times under a million seconds every sum and difference Decimal would do has
+# well under its 28 digits of precision, so the integer math is exact in the
+# same places Decimal is, and the output is identical.  Anything that doesn't
+# fit, like a phrase that doesn't split evenly, uses the Decimal path.
+TICK_DIGITS = 20
+TICKS = 10 ** TICK_DIGITS
+MAX_TICKS = 1000000 * TICKS
+TICK_PAD = ["0" * (TICK_DIGITS - i) for i in range(TICK_DIGITS + 1)]
+
+# Every tag fill_out replaces in the template
+TEMPLATE_TAGS = [
+    "[[TITLE]]",
+    '"[[WORDS_VAR]]"',
+    "[[TITLE_META]]",
+    "[[WORD_ID]]",
+    '"[[EXPECTED_DUR]]"',
+    "[[META_MP3_NAME]]",
+    "[[MP3_NAME]]",
+    "<!-- EXTRA_WIDGETS -->",
+    '"[[SEGMENTS_DATA]]"',
+    "<!-- EXTRA_HEAD -->",
+]
+
+# Compiled templates, by filename and assets option, along with the mtime and size
+# they were compiled from
+_template_cache = {}
+
+# Options for how pages are rendered, can be changed with the "render" settings
+RENDER_DEFAULTS = {
+    # "inline" to include the player's CSS and JS in each page, or "external"
+    # to link to shared files, see write_player_assets
+    "assets": "inline",
+    # "inline" to include the word data in each page, or "sidecar" to write it
+    # to a separate file next to the page that the page loads
+    "words": "inline",
+    # "json" for the word data, or "compact" for the smaller binary format
+    # described in WordColumns
+    "encoding": "json",
+}
+
+# The start of the compact word format, followed by the version
+COMPACT_MAGIC = b"PTW"
+COMPACT_VERSION = 1
+
+# The word data columns are kept in memory up to this size, then moved to disk
+SPOOL_SIZE = 256 * 1024
+# How many words to gather before adding them to the columns
+COLUMN_CHUNK = 4096
 
 class IsParagraph:
-    def __init__(self):
+    def __init__(self, ticks=False, window=10):
+        # Limits, either in ticks or seconds
+        self.ticks = ticks
+        self.window = window
+        self.min_gap = TICKS // 20 if ticks else Decimal('0.05')
+        self.misc_limit = 60 * TICKS if ticks else 60
         self.last_end = 0
         self.last_sentence = False
-        self.gaps = []
+        # The recent gaps after sentences, in the order they were seen, and sorted
+        self.gaps = deque()
+        self.sorted_gaps = []
         self.was_sentence = False
         self.was_paragraph = False
         self.speakers = {}
 
-    def prep_speakers(self, words):
+    def set_speakers(self, totals):
+        # Pick a letter for each speaker from the total time they spoke
         self.speakers = {}
-        temp = {}
-        for word in enumerate_words(words):
-            if 'start' in word:
-                if word.get('speaker', -1) not in temp:
-                    temp[word.get('speaker', -1)] = 0
-                temp[word.get('speaker', -1)] += max(word['end'], word['start']) - min(word['end'], word['start'])
-        temp = [(dur, speaker_id) for speaker_id, dur in temp.items()]
+        temp = [(dur, speaker_id) for speaker_id, dur in totals.items()]
         temp.sort(reverse=True)
 
         misc_speaker = None
         for dur, speaker_id in temp:
             if misc_speaker is None:
                 self.speakers[speaker_id] = chr(ord('A') + (len(self.speakers) % 26))
-                if dur <= 60:
+                if dur <= self.misc_limit:
                     misc_speaker = self.speakers[speaker_id]
             else:
                 self.speakers[speaker_id] = misc_speaker
@@ -57,12 +120,19 @@ class IsParagraph:
 
             dur = min(start, end) - self.last_end
             self.gaps.append(dur)
-            if len(self.gaps) > 10:
-                self.gaps.pop(0)
-            best = min((sum(abs(x - y) for x in self.gaps), y) for y in self.gaps)[1]
-            best = max(best, Decimal('0.05'))
-            if dur > best and ((dur - best) / best) > 2:
-                self.was_paragraph = True
+            insort(self.sorted_gaps, dur)
+            if len(self.gaps) > self.window:
+                del self.sorted_gaps[bisect_left(self.sorted_gaps, self.gaps.popleft())]
+            # The typical gap is the one closest to all of the others, that's
+            # the median, or the lower of the two middle values for an even count
+            best = self.sorted_gaps[(len(self.sorted_gaps) - 1) // 2]
+            best = max(best, self.min_gap)
+            if dur > best:
+                if self.ticks:
+                    # The same test as below, without leaving integers
+                    self.was_paragraph = (dur - best) > best * 2
+                else:
+                    self.was_paragraph = ((dur - best) / best) > 2
 
         self.last_end = max(start, end)
         self.last_sentence = (len(word) > 0 and word[-1] in "\\),:;.?!'\"")
@@ -105,86 +175,346 @@ def split_phrases(words):
         else:
             yield word
 
-def fill_out(words, mp3_fn):
-    with open("template.html", "rt") as f:
-        data = f.read()
-    
-    # Get the duration from the MP3
-    with open(mp3_fn, "rb") as f:
-        duration = ReadMP3.get_duration(f)
-
-    # For engines that output phrases instead of words, invent where the boundaries are
-    if " " in "".join(x[0] for x in words):
-        # There's a space in at least on word, so pass it off to our helper to split up
-        words = list(split_phrases(words))
-
-    is_para = IsParagraph()
-    is_para.prep_speakers(words)
-
-    last_speaker = ""
-    paragraphs = []
-    start_time = Decimal(0)
-    paragraph = []
-    for i, word in enumerate(enumerate_words(words)):
-        is_para.check(word)
-
-        para_break = False
-
-        if (word['start'] - start_time) > Decimal(45) and is_para.was_sentence:
-            para_break = True
-
-        if (word['start'] - start_time) > Decimal(60):
-            para_break = True
-        
-        if i == 0 or (word['speaker'] != last_speaker and is_para.was_sentence):
-            if i > 0:
-                para_break = True
-            last_speaker = word['speaker']
-
-        if i == len(words) - 1:
-            paragraph.append({
-                'word': word['word'], 
-                'start': word['start'], 
-                'end': word['end'], 
-                'speaker_encoded': is_para.encode_speaker(word['speaker']),
-            })
-            para_break = True
-
-        if para_break:
-            paragraphs.append(paragraph)
-            paragraph = []
-            start_time = word['start']
-
-        if len(word) > 0:
-            paragraph.append({
-                'word': word['word'], 
-                'start': word['start'], 
-                'end': word['end'], 
-                'speaker_encoded': is_para.encode_speaker(word['speaker']),
-            })
-
-    # Create a dump out of final data to send to the webpage, the webpage itself
-    # will merge these to try to prevent too much animated noise
-    simple = {'off': [], 'word': [], 'speaker': [], 'para': []}
-    last_pos, last_value = 0, 0
+def to_ticks(value):
+    # Turn a number into ticks, matching Decimal(str(value)) exactly, returns
+    # None if that's not possible
+    whole, _, frac = str(value).partition(".")
+    if len(frac) <= TICK_DIGITS:
+        try:
+            ret = int(whole + frac + TICK_PAD[len(frac)])
+        except ValueError:
+            # Something like "1e-05", let Decimal sort it out
+            ret = Decimal(str(value)).scaleb(TICK_DIGITS)
+            if not ret.is_finite() or ret != ret.to_integral_value():
+                return None
+            ret = int(ret)
+        if -MAX_TICKS <= ret <= MAX_TICKS:
+            return ret
+    return None
+
+def iter_ticks(words, split):
+    # The same as enumerate_words, and split_phrases if split is set, but with
+    # times in ticks.  Yields None and stops if any time can't be stored exactly.
+    for frame in words:
+        if isinstance(frame, dict):
+            yield None
+            return
+        if len(frame) == 3:
+            word, start, end = frame
+            speaker = -1
+        else:
+            word, start, end, speaker = frame
+        start, end = to_ticks(start), to_ticks(end)
+        if start is None or end is None:
+            yield None
+            return
+        if split:
+            if start > end:
+                start, end = end, start
+            if " " in word:
+                temp = word.split(" ")
+                dur, left = divmod(end - start, len(temp))
+                if left != 0:
+                    yield None
+                    return
+                for i, sub_word in enumerate(temp):
+                    yield {
+                        'word': sub_word,
+                        'start': i * dur + start,
+                        'end': (i + 1) * dur + start,
+                        'speaker': speaker,
+                    }
+                continue
+        yield {'word': word, 'start': start, 'end': end, 'speaker': speaker}
+
+class StreamTranscript:
+    # A saved transcript, a gzipped JSON list of words, that's read a bit at a
+    # time each time it's looped over, so the whole thing is never in memory.
+    # It can be passed to fill_out in place of the list of words.
+    def __init__(self, fn, chunk_size=65536):
+        self.fn = fn
+        self.chunk_size = chunk_size
+
+    def __iter__(self):
+        decoder = json.JSONDecoder()
+        with gzip.open(self.fn, "rt", encoding="utf-8") as f:
+            buf, pos, eof = "", 0, False
+            expect = "["
+            while True:
+                # Find the next thing that's not whitespace, reading more if needed
+                while True:
+                    while pos < len(buf) and buf[pos] in " \t\r\n":
+                        pos += 1
+                    if pos < len(buf) or eof:
+                        break
+                    buf, pos = f.read(self.chunk_size), 0
+                    eof = len(buf) == 0
+                if pos == len(buf):
+                    raise Exception(f"Unexpected end of transcript in {self.fn}")
+
+                if buf[pos] == "]" and expect != "[":
+                    return
+                if expect is not None:
+                    # Either the start of the list, or the comma after an item
+                    if buf[pos] != expect:
+                        raise Exception(f"Unexpected '{buf[pos]}' in transcript {self.fn}")
+                    pos += 1
+                    expect = None
+                    continue
+
+                # Decode the next item, it might run past what's been read
+                while True:
+                    try:
+                        item, end = decoder.raw_decode(buf, pos)
+                        if end < len(buf) or eof:
+                            break
+                    except json.JSONDecodeError:
+                        if eof:
+                            raise
+                    more = f.read(self.chunk_size)
+                    eof = len(more) == 0
+                    buf, pos = buf[pos:] + more, 0
+                pos = end
+                expect = ","
+                yield item
+
+def compile_template(data):
+    # Turn the template into a list of static strings and dynamic lines.  The
+    # output has each line stripped, so that's done here for the static lines.
+    # A dynamic line is a list of static text alternating with tags, along with
+    # a flag if it starts and ends with static text, so it can be written out
+    # as is.  Otherwise, the tag values need to be stripped along with the line.
+    all_tags = re.compile("(" + "|".join(re.escape(k) for k in TEMPLATE_TAGS) + ")")
+    ret = []
+    static = []
+    for line in data.split("\n"):
+        parts = all_tags.split(line)
+        if len(parts) == 1:
+            static.append(line.strip())
+            continue
+        if len(static) > 0:
+            ret.append("".join(static))
+            static = []
+        simple = len(parts[0].strip()) > 0 and len(parts[-1].strip()) > 0
+        if simple:
+            parts[0], parts[-1] = parts[0].lstrip(), parts[-1].rstrip()
+        ret.append((simple, parts))
+    if len(static) > 0:
+        ret.append("".join(static))
+    return ret
+
+def strip_lines(data):
+    # The pages are written out with each line stripped
+    return "".join(x.strip() for x in data.split("\n"))
+
+def split_assets(data):
+    # Move the player's CSS and JS out of the template into shared files named
+    # after a hash of their contents, returns the template that links to them,
+    # and a list of (filename, contents) for the files
+    css_start = data.index("<style>")
+    css_end = data.index("</style>", css_start) + len("</style>")
+    js_start = data.index("/* --- Minify Start --- */")
+    js_end = data.index("/* --- Minify End --- */") + len("/* --- Minify End --- */")
+    if not (css_end <= js_start):
+        raise Exception("Expected the player's CSS before its JS in the template")
+
+    assets = []
+    for ext, value in [("css", data[css_start + len("<style>"):css_end - len("</style>")]), ("js", data[js_start:js_end])]:
+        value = strip_lines(value)
+        if any(x in value for x in TEMPLATE_TAGS):
+            raise Exception(f"The player's {ext} can't contain template tags")
+        assets.append((f"player-{sha256(value.encode('utf-8')).hexdigest()[:16]}.{ext}", value))
+
+    # The script is deferred, it only needs the page's meta data, which is
+    # defined before it, and everything else happens when the page is loaded
+    ret = data[:css_start] + f'<link rel="stylesheet" type="text/css" href="{assets[0][0]}" />'
+    ret += data[css_end:js_start] + data[js_end:]
+    ret = ret.replace("</head>", f'<script src="{assets[1][0]}" defer></script>\n</head>', 1)
+    return ret, assets
+
+def load_template(fn="template.html", assets="inline"):
+    # Load and compile a template, only doing the work again if it changes.
+    # Returns the template and the list of asset files it links to.
+    stat = os.stat(fn)
+    key = (os.path.abspath(fn), assets)
+    cached = _template_cache.get(key)
+    if cached is None or cached[0] != (stat.st_mtime_ns, stat.st_size):
+        with open(fn, "rt") as f:
+            data = f.read()
+        if assets == "inline":
+            files = []
+        elif assets == "external":
+            data, files = split_assets(data)
+        else:
+            raise Exception(f"Unknown assets option '{assets}'")
+        cached = ((stat.st_mtime_ns, stat.st_size), compile_template(data), files)
+        _template_cache[key] = cached
+    return cached[1], cached[2]
+
+def write_player_assets(dest_dir, template_fn="template.html"):
+    # Write out the shared player files for pages rendered with external
+    # assets, they're named after their contents, so existing ones are left alone
+    _, files = load_template(template_fn, "external")
+    ret = []
+    for name, value in files:
+        fn = os.path.join(dest_dir, name)
+        if not os.path.isfile(fn):
+            with open(fn + ".tmp", "wt", newline="", encoding="utf-8") as f:
+                f.write(value)
+            os.replace(fn + ".tmp", fn)
+        ret.append(fn)
+    return ret
+
+def render_template(template, to_replace, output):
+    # Write out a compiled template, with the tags replaced.  A value can also
+    # be a function that writes the value to the output, for values too large
+    # to build up as a string.
+    for item in template:
+        if isinstance(item, str):
+            output.write(item)
+        else:
+            simple, parts = item
+            values = [to_replace[x] if i % 2 == 1 else x for i, x in enumerate(parts)]
+            if simple and not any(isinstance(x, str) and "\n" in x for x in values[1::2]):
+                for x in values:
+                    if isinstance(x, str):
+                        output.write(x)
+                    else:
+                        x(output)
+            else:
+                for i, x in enumerate(values):
+                    if not isinstance(x, str):
+                        temp = io.StringIO()
+                        x(temp)
+                        values[i] = temp.getvalue()
+                output.write("".join(x.strip() for x in "".join(values).split("\n")))
+
+def get_render_options(render=None):
+    ret = RENDER_DEFAULTS.copy()
+    if render is not None:
+        ret.update(render)
+    return ret
+
+def mark_last(items):
+    # Yields each item along with a flag that's set for the last one
+    items = iter(items)
+    for cur in items:
+        break
+    else:
+        return
+    for item in items:
+        yield cur, False
+        cur = item
+    yield cur, True
+
+def build_columns(words, encoding, split, ticks):
+    # Break the words into paragraphs in one pass, adding them to the word data
+    # for the page as it goes.  Returns the WordColumns, along with if phrases
+    # were split and ticks were used.  If a phrase turns up when split isn't
+    # set, or a time doesn't fit in ticks, returns None for the columns, along
+    # with the options the pass needs to start over with.
+    if ticks:
+        stream = iter_ticks(words, split)
+        unit = TICKS
+    else:
+        # For engines that output phrases instead of words, invent where the boundaries are
+        stream = split_phrases(words) if split else enumerate_words(words)
+        unit = 1
+
+    is_para = IsParagraph(ticks=ticks)
+    columns = WordColumns(encoding)
+    # The speakers in the order they're first seen, and how long each spoke,
+    # they're given letters once the totals are known
+    speakers = {}
+    totals = {}
+
+    last_pos = 0
     def track_pos(value):
-        nonlocal last_pos, last_value
-        last_value = value
-        value = int(value * 100)
+        nonlocal last_pos
+        if unit == TICKS:
+            # Truncate toward zero, like int() on a Decimal
+            value = (abs(value) * 100 // TICKS) * (1 if value >= 0 else -1)
+        else:
+            value = int(value * 100)
         ret = value - last_pos
         last_pos = value
         return ret
 
-    for i, paragraph in enumerate(paragraphs):
-        merged = []
-        for word in paragraph:
-            merged.append(word)
+    last_speaker = ""
+    start_time = 0 if unit == TICKS else Decimal(0)
+    para_len = 0
+    try:
+        for i, (word, is_last) in enumerate(mark_last(stream)):
+            if word is None:
+                columns.close()
+                return None, split, False
+            if not split and " " in word['word']:
+                # There's a space in at least one word, so every word is split up
+                columns.close()
+                return None, True, ticks
+
+            is_para.check(word)
+
+            para_break = False
+
+            if (word['start'] - start_time) > 45 * unit and is_para.was_sentence:
+                para_break = True
+
+            if (word['start'] - start_time) > 60 * unit:
+                para_break = True
 
-        for word_number, word in enumerate(merged):
-            simple['off'].append(track_pos(word['start']))
-            simple['word'].append(word['word'].replace("|", "/"))
-            simple['speaker'].append(word.get('speaker_encoded', ' '))
-            simple['para'].append('.' if word_number == 0 else ' ')
+            if i == 0 or (word['speaker'] != last_speaker and is_para.was_sentence):
+                if i > 0:
+                    para_break = True
+                last_speaker = word['speaker']
+
+            # The last word always stays in the paragraph it's in
+            if para_break and not is_last:
+                para_len = 0
+                start_time = word['start']
+
+            speaker = word['speaker']
+            if speaker not in speakers:
+                speakers[speaker] = len(speakers)
+                totals[speaker] = 0
+            totals[speaker] += max(word['end'], word['start']) - min(word['end'], word['start'])
+
+            columns.add(track_pos(word['start']), word['word'], speakers[speaker], para_len == 0)
+            para_len += 1
+    except:
+        columns.close()
+        raise
+
+    is_para.set_speakers(totals)
+    columns.set_speakers([is_para.encode_speaker(x) for x in speakers])
+    return columns, split, ticks
+
+def fill_out(words, mp3_fn, output=None, template_fn="template.html", duration=None, render=None, page_fn=None, use_ticks=True):
+    # Render the webpage for words, if output is a file, write the page to it,
+    # and return a list of any other files written, otherwise return the page
+    # as a string.  page_fn is the filename of the page, and is needed to know
+    # where to put the word data when it's not inline.  The words might be
+    # looped over more than once, so they can be a list, or a StreamTranscript
+    # to render a long transcript without loading all of it.
+    render = get_render_options(render)
+    if render["words"] not in {"inline", "sidecar"}:
+        raise Exception(f"Unknown words option '{render['words']}'")
+    if render["encoding"] not in {"json", "compact"}:
+        raise Exception(f"Unknown encoding option '{render['encoding']}'")
+    if render["words"] == "sidecar" and page_fn is None:
+        raise Exception("The page's filename is needed to write the word data next to it")
+    template, _ = load_template(template_fn, render["assets"])
+
+    # Get the duration from the MP3, if the caller doesn't already know it
+    if duration is None:
+        with open(mp3_fn, "rb") as f:
+            duration = ReadMP3.get_duration(f)
+
+    # Start out assuming there are no phrases to split and the times fit in
+    # ticks, the pass over the words starts again if that turns out to be wrong
+    columns, split, ticks = None, False, use_ticks
+    while columns is None:
+        columns, split, ticks = build_columns(words, render["encoding"], split, ticks)
 
     fn = mp3_fn.replace("\\", "/").split("/")[-1]
 
@@ -195,56 +525,302 @@ def fill_out(words, mp3_fn):
         # 'published': '<not used>',
     }
 
-    to_replace = {
-        # The HTML title
-        "[[TITLE]]": html.escape(fn.replace(".mp3", "").replace("_", " ")),
-        # The encoded and compressed metadata, include words, timings, and speaker information
-        '"[[WORDS_VAR]]"': encode_words(simple),
-        # The title, used for creating Media Metadata (for use on mobile devices)
-        "[[TITLE_META]]": base64.b64encode(safe_json_dumps(details).encode("utf-8")).decode("utf-8"),
-        # An ID used to store local information about the playback position
-        "[[WORD_ID]]": sha256(fn.encode("utf-8")).hexdigest()[:10],
-        # The total length of the MP3 file, used to render the progress bar
-        '"[[EXPECTED_DUR]]"': safe_json_dumps(duration),
-        # The name of the MP3 file being shown, currently unused
-        "[[META_MP3_NAME]]": html.escape(fn),
-        # The name of the MP3 file for the player to load
-        "[[MP3_NAME]]": html.escape(fn),
-        # A chance for the template to include extra HTML, currently unused
-        "<!-- EXTRA_WIDGETS -->": "",
-        # The render of the page supports showing segments.  This could be generated from MP3 chapters and/or by use of 
-        # a LLM to find the segments, but as of now, this is unused here.
-        '"[[SEGMENTS_DATA]]"': '" "',
-    }
+    other_files = []
+    extra_head = ""
+    try:
+        if render["words"] == "sidecar":
+            sidecar_fn = write_sidecar(page_fn, columns)
+            other_files.append(sidecar_fn)
+            sidecar_name = html.escape(os.path.basename(sidecar_fn))
+            words_var = safe_json_dumps({"src": os.path.basename(sidecar_fn)})
+            # Let the browser start loading the data before the player asks for it
+            extra_head = f'<link rel="preload" href="{sidecar_name}" as="fetch" crossorigin="anonymous">'
+        else:
+            def words_var(output):
+                # The compressed data as a base64 string, written straight
+                # into the page as it's compressed
+                output.write('"')
+                writer = Base64Writer(output)
+                compress_words(columns, writer)
+                writer.close()
+                output.write('"')
+
+        to_replace = {
+            # The HTML title
+            "[[TITLE]]": html.escape(fn.replace(".mp3", "").replace("_", " ")),
+            # The encoded and compressed metadata, include words, timings, and speaker information
+            '"[[WORDS_VAR]]"': words_var,
+            # The title, used for creating Media Metadata (for use on mobile devices)
+            "[[TITLE_META]]": base64.b64encode(safe_json_dumps(details).encode("utf-8")).decode("utf-8"),
+            # An ID used to store local information about the playback position
+            "[[WORD_ID]]": sha256(fn.encode("utf-8")).hexdigest()[:10],
+            # The total length of the MP3 file, used to render the progress bar
+            '"[[EXPECTED_DUR]]"': safe_json_dumps(duration),
+            # The name of the MP3 file being shown, currently unused
+            "[[META_MP3_NAME]]": html.escape(fn),
+            # The name of the MP3 file for the player to load
+            "[[MP3_NAME]]": html.escape(fn),
+            # A chance for the template to include extra HTML, currently unused
+            "<!-- EXTRA_WIDGETS -->": "",
+            # The render of the page supports showing segments.  This could be generated from MP3 chapters and/or by use of 
+            # a LLM to find the segments, but as of now, this is unused here.
+            '"[[SEGMENTS_DATA]]"': '" "',
+            # Extra tags for the head, used to preload the word data when it's in a separate file
+            "<!-- EXTRA_HEAD -->": extra_head,
+        }
+
+        if output is None:
+            output = io.StringIO()
+            render_template(template, to_replace, output)
+            return output.getvalue()
+
+        render_template(template, to_replace, output)
+    finally:
+        columns.close()
+    return other_files
+
+def write_sidecar(page_fn, columns):
+    # Write the word data for a page to a file next to it, named after a hash
+    # of the data so it can be cached.  Older ones for the page are left for
+    # remove_old_sidecars, since the page being served still points at one.
+    base = page_fn[:-5] if page_fn.endswith(".html") else page_fn
+    temp_fn = base + ".words.dat.tmp"
+    with open(temp_fn, "wb") as f:
+        compress_words(columns, f)
+    ret = f"{base}.{hash_file(temp_fn)[:12]}.words.dat"
+    os.replace(temp_fn, ret)
+    return ret
+
+def remove_old_sidecars(page_fn, keep):
+    # Remove the word data files from earlier renders of a page, other than
+    # the ones in keep, once the new page is in place
+    base = page_fn[:-5] if page_fn.endswith(".html") else page_fn
+    dirname = os.path.dirname(os.path.abspath(page_fn))
+    keep = {os.path.basename(x) for x in keep}
+    prefix, suffix = os.path.basename(base) + ".", ".words.dat"
+    for cur in os.listdir(dirname):
+        if cur.startswith(prefix) and cur.endswith(suffix) and cur not in keep:
+            if len(cur) == len(prefix) + 12 + len(suffix):
+                os.unlink(os.path.join(dirname, cur))
+
+def write_varint(out, value):
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+def write_runs(out, column, run):
+    # Add a column of bytes to runs of the same value, the run in progress is
+    # passed in as [value, count] and returned, so the column can be added a
+    # bit at a time
+    for value, group in groupby(column):
+        count = sum(1 for _ in group)
+        if run is not None and run[0] == value:
+            run[1] += count
+        else:
+            if run is not None:
+                out.append(run[0])
+                write_varint(out, run[1])
+            run = [value, count]
+    return run
+
+class WordColumns:
+    # The word data for the page, added a word at a time.  Each column is
+    # gathered in a temporary file that moves to disk once it's large, so the
+    # memory used doesn't grow with the length of the transcript.
+    #
+    # The "json" encoding is the JSON object:
+    #   {"off":[offsets],"word":"words|split|by|pipes","speaker":"AAB..","para":". .."}
+    # The "compact" encoding is a binary format, decoded by decodeCompact in
+    # the template:
+    #   "PTW", version byte, varint word count
+    #   varint vocabulary size, then each word as a varint length and UTF-8
+    #   a varint vocabulary index for each word, most common words first
+    #   a zigzag varint for each offset
+    #   the speaker, then paragraph, columns as runs of a byte and a varint count
+    # All varints are little endian base 128.
+    #
+    # Speakers are added as a number, and the letters for them are set once
+    # all of the words are added.  In the compact encoding, the words are kept
+    # as text until then too, since the vocabulary isn't known.
+    def __init__(self, encoding):
+        self.encoding = encoding
+        self.count = 0
+        self.counts = {}
+        self.letters = None
+        # The offset, word, speaker, and paragraph columns
+        self.columns = [tempfile.SpooledTemporaryFile(SPOOL_SIZE) for _ in range(4)]
+        self.pending = [[], [], [], []]
+        self.para_run = None
+
+    def add(self, off, word, speaker, para):
+        self.pending[0].append(off)
+        self.pending[1].append(word.replace("|", "/"))
+        self.pending[2].append(speaker)
+        self.pending[3].append(para)
+        self.count += 1
+        if len(self.pending[0]) >= COLUMN_CHUNK:
+            self.flush()
+
+    def set_speakers(self, letters):
+        # The letter for each speaker number
+        self.letters = letters
+
+    def flush(self):
+        # Move the pending words to the columns
+        off, words, speaker, para = self.pending
+        if len(off) == 0:
+            return
+        first = self.count == len(off)
+        temp = bytearray()
+        for x in speaker:
+            write_varint(temp, x)
+        self.columns[2].write(temp)
+        para = b"".join(b"." if x else b" " for x in para)
+        if self.encoding == "json":
+            self.columns[0].write(((",", "")[first] + ",".join(str(x) for x in off)).encode("utf-8"))
+            # Escaping is done a character at a time, so escaping each chunk
+            # is the same as escaping the whole string
+            self.columns[1].write((("|", "")[first] + safe_json_dumps("|".join(words))[1:-1]).encode("utf-8"))
+            self.columns[3].write(para)
+        else:
+            temp = bytearray()
+            for x in off:
+                write_varint(temp, x * 2 if x >= 0 else -x * 2 - 1)
+            self.columns[0].write(temp)
+            for word in words:
+                self.counts[word] = self.counts.get(word, 0) + 1
+            self.columns[1].write((("|", "")[first] + "|".join(words)).encode("utf-8"))
+            temp = bytearray()
+            self.para_run = write_runs(temp, para, self.para_run)
+            self.columns[3].write(temp)
+        self.pending = [[], [], [], []]
+
+    def read_column(self, i):
+        # Read back a column, a chunk at a time
+        column = self.columns[i]
+        column.seek(0)
+        while True:
+            data = column.read(SPOOL_SIZE)
+            if len(data) == 0:
+                break
+            yield data
+
+    def read_speakers(self):
+        # Read back the speaker column, turned into letters
+        letters = [x.encode("ascii") for x in self.letters]
+        if len(letters) <= 0x80:
+            # Every speaker number is a single byte, so it's a simple translation
+            table = b"".join(letters) + b" " * (256 - len(letters))
+            for data in self.read_column(2):
+                yield data.translate(table)
+            return
+        value, shift = 0, 0
+        for data in self.read_column(2):
+            ret = bytearray()
+            for x in data:
+                value |= (x & 0x7f) << shift
+                shift += 7
+                if x < 0x80:
+                    ret += letters[value]
+                    value, shift = 0, 0
+            yield bytes(ret)
+
+    def read_words(self):
+        # Read back the words in the compact encoding's column of text
+        if self.count == 0:
+            return
+        left = b""
+        for data in self.read_column(1):
+            parts = (left + data).split(b"|")
+            left = parts.pop()
+            yield from parts
+        yield left
+
+    def write_to(self, f):
+        # Write out the encoded data to a binary file
+        self.flush()
+        if self.encoding == "json":
+            parts = [b'{"off":[', self.read_column(0), b'],"word":"', self.read_column(1)]
+            parts += [b'","speaker":"', self.read_speakers(), b'","para":"', self.read_column(3), b'"}']
+        else:
+            vocab = sorted(self.counts, key=lambda x: (-self.counts[x], x))
+            index = {word.encode("utf-8"): i for i, word in enumerate(vocab)}
+            header = bytearray(COMPACT_MAGIC)
+            header.append(COMPACT_VERSION)
+            write_varint(header, self.count)
+            write_varint(header, len(vocab))
+            for word in vocab:
+                word = word.encode("utf-8")
+                write_varint(header, len(word))
+                header += word
+
+            def indexes():
+                temp = bytearray()
+                for word in self.read_words():
+                    write_varint(temp, index[word])
+                    if len(temp) >= SPOOL_SIZE:
+                        yield bytes(temp)
+                        temp = bytearray()
+                yield bytes(temp)
+
+            def speaker_runs():
+                run = None
+                for data in self.read_speakers():
+                    temp = bytearray()
+                    run = write_runs(temp, data, run)
+                    yield bytes(temp)
+                yield self.end_run(run)
+
+            parts = [bytes(header), indexes(), self.read_column(0), speaker_runs(), self.read_column(3), self.end_run(self.para_run)]
+        for part in parts:
+            if isinstance(part, bytes):
+                f.write(part)
+            else:
+                for data in part:
+                    f.write(data)
+
+    def end_run(self, run):
+        # The bytes for the run still going at the end of a column
+        ret = bytearray()
+        if run is not None:
+            ret.append(run[0])
+            write_varint(ret, run[1])
+        return bytes(ret)
+
+    def close(self):
+        for column in self.columns:
+            column.close()
+
+class Base64Writer:
+    # A binary file that writes everything written to it as base64 to a text file
+    def __init__(self, output):
+        self.output = output
+        self.left = b""
+
+    def write(self, data):
+        ret = len(data)
+        data = self.left + bytes(data)
+        cut = len(data) - len(data) % 3
+        self.left = data[cut:]
+        if cut > 0:
+            self.output.write(base64.b64encode(data[:cut]).decode("ascii"))
+        return ret
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if len(self.left) > 0:
+            self.output.write(base64.b64encode(self.left).decode("ascii"))
+            self.left = b""
 
-    all_tags = "(?P<tag>" + "|".join(re.escape(k) for k in to_replace) + ")"
-    data = re.sub(all_tags, lambda m: to_replace[m.group('tag')], data)
-
-    data = "".join(x.strip() for x in data.split("\n"))
-
-    return data
-
-def encode_words(value):
-    # Compress and encode the simple version of the word data to a compressed
-    # format used by the webpage
-    
-    # Turn the list of words to a single string separated by a pipe.
-    value['word'] = "|".join(value['word'])
-    # The list of paragraph starts is just a "." for a paragraph start,
-    # and " " otherwise, so turn it into a long string
-    value['para'] = "".join(value['para'])
-    # Speakers are A-Z, or " " for no speaker, so again, a simple string
-    value['speaker'] = "".join(value['speaker'])
-    # Place the rest in a compressed json dump
-    value = safe_json_dumps(value)
-    value = value.encode("utf-8")
-    value = gzip.compress(value)
-    value = base64.b64encode(value)
-    value = value.decode("utf-8")
-    # One final pass through json just to ensure the string is javascript safe
-    value = safe_json_dumps(value)
-
-    return value
+def compress_words(columns, f):
+    # Compress the word data to the format used by the webpage, writing it to a
+    # binary file.  The gzip timestamp is left out so the same data always
+    # gives the same bytes.
+    with gzip.GzipFile(filename="", mode="wb", fileobj=f, mtime=0) as gz:
+        columns.write_to(gz)
 
 if __name__ == "__main__":
     print("This module is not meant to be run directly.")
@@ -2,14 +2,20 @@
 
 from command_opts import opt, main_entry
 from list_picker import list_picker
+import audio_cache
+import build_manifest
 import gzip
 import json
 import mp3_splitter
+import multiprocessing
 import os
 import pickle
+import silence
 import templater
+import time
 
 ENGINES = {}
+import engines.null
 import engines.openai
 import engines.transcribe
 import engines.whisper
@@ -19,6 +25,7 @@ import engines.whisperx
 def setup_engines():
     # Validate the engines implement the expected functions
     to_setup = [
+        engines.null,
         engines.openai,
         engines.transcribe,
         engines.whisper,
@@ -79,6 +86,29 @@ def enumerate_words(data):
             word, start, end, speaker = frame
         yield word, start, end, speaker
 
+def run_engine(engine, settings, source_fn, stats, temp=False):
+    # Run the engine on one file, trimming silence first if requested, returns the
+    # engine's data along with the regions of the source audio that were kept.
+    # Temp files, like chunks of the source, are kept out of the audio cache.
+    if settings.get("trim_silence", False) and engine.get_settings().get("local_audio", False):
+        temp_wav, regions, skipped, audio = silence.trim_silence(
+            source_fn,
+            ffmpeg=settings["engine_details"].get("ffmpeg", "ffmpeg"),
+            cache=not temp,
+        )
+        stats["skipped"] += skipped
+        try:
+            # Hand the engine the trimmed audio, rather than decoding it again
+            with audio_cache.uncached(temp_wav, audio):
+                return engine.run_engine(settings["engine_details"], temp_wav), regions
+        finally:
+            os.unlink(temp_wav)
+
+    if temp:
+        with audio_cache.uncached(source_fn):
+            return engine.run_engine(settings["engine_details"], source_fn), None
+    return engine.run_engine(settings["engine_details"], source_fn), None
+
 @opt("Transcribe an MP3 file and create a webpage, also save data")
 def create_webpage_and_data(settings_file):
     create_webpage_internal(settings_file, True)
@@ -96,6 +126,8 @@ def create_webpage_internal(settings_file, save_data=False):
     data_fn = settings_file + ".gz"
 
     data = None
+    # The saved transcript, if the page is being rendered from one
+    transcript_fn = None
 
     if data is None:
         if os.path.isfile(data_fn):
@@ -110,8 +142,10 @@ def create_webpage_internal(settings_file, save_data=False):
         if os.path.isfile(dest + ".json.gz"):
             with gzip.open(dest + ".json.gz", "rb") as f:
                 data = json.load(f)
+            transcript_fn = dest + ".json.gz"
 
     if data is None:
+        stats = {"skipped": 0}
         if 'limit_seconds' in engine_settings or 'limit_bytes' in engine_settings:
             temp = []
             print("Creating separate chunks...")
@@ -119,17 +153,48 @@ def create_webpage_internal(settings_file, save_data=False):
                 settings["source_mp3"], 
                 duration_in_seconds=engine_settings.get('limit_seconds'),
                 size_in_bytes=engine_settings.get('limit_bytes'),
+                chunk_count=settings.get('chunk_count'),
             )
-            for chunk in chunks:
-                temp.append({
-                    "offset": chunk["offset"],
-                    "duration": chunk["duration"],
-                    "data": engine.run_engine(settings["engine_details"], chunk['fn']),
-                })
-                os.unlink(chunk['fn'])
+            if hasattr(engine, "run_engine_batch"):
+                # This engine can work on all of the chunks at once
+                results = engine.run_engine_batch(
+                    settings["engine_details"],
+                    [(chunk['fn'], chunk['duration']) for chunk in chunks],
+                )
+                for chunk, result in zip(chunks, results):
+                    temp.append({
+                        "offset": chunk["offset"],
+                        "duration": chunk["duration"],
+                        "data": result,
+                    })
+                    os.unlink(chunk['fn'])
+            else:
+                for chunk in chunks:
+                    result, regions = run_engine(engine, settings, chunk['fn'], stats, temp=True)
+                    temp.append({
+                        "offset": chunk["offset"],
+                        "duration": chunk["duration"],
+                        "data": result,
+                        "regions": regions,
+                    })
+                    os.unlink(chunk['fn'])
             data = b'CHUNKED' + pickle.dumps(temp)
         else:
-            data = engine.run_engine(settings["engine_details"], settings["source_mp3"])
+            data, regions = run_engine(engine, settings, settings["source_mp3"], stats)
+            if regions is not None:
+                # Store trimmed results as a single chunk so the timestamps can be
+                # shifted back to the source audio when parsing
+                with open(settings["source_mp3"], "rb") as f:
+                    duration = mp3_splitter.ReadMP3.get_duration(f)
+                data = b'CHUNKED' + pickle.dumps([{
+                    "offset": 0,
+                    "duration": duration,
+                    "data": data,
+                    "regions": regions,
+                }])
+
+        if stats["skipped"] > 0:
+            print(f"Trimming silence skipped {stats['skipped']:.1f} seconds of audio")
 
         with gzip.open(data_fn, "wb") as f:
             f.write(data)
@@ -140,7 +205,13 @@ def create_webpage_internal(settings_file, save_data=False):
             data = []
             for cur in temp:
                 chunk = engine.parse_data(cur['data'])
+                to_source = None
+                if cur.get('regions') is not None:
+                    # Silence was trimmed from this chunk, so move the timestamps back
+                    to_source = silence.make_mapper(cur['regions'])
                 for word, start, end, speaker in enumerate_words(chunk):
+                    if to_source is not None:
+                        start, end = to_source(start), to_source(end, True)
                     data.append((word, start + cur['offset'], end + cur['offset'], speaker))
         else:
             # Non-chunked data, just read and parse it as is
@@ -154,11 +225,124 @@ def create_webpage_internal(settings_file, save_data=False):
     if save_data:
         with gzip.open(dest + ".json.gz", "wt", newline="", encoding="utf-8") as f:
             json.dump(data, f, separators=(',', ':'))
+        transcript_fn = dest + ".json.gz"
+
+    render = templater.get_render_options(settings.get("render"))
+    template_fn = "template.html"
+    if render["assets"] == "external":
+        templater.write_player_assets(os.path.dirname(os.path.abspath(dest)), template_fn)
 
-    data = templater.fill_out(data, settings['source_mp3'])
-    with open(dest + ".html", "wt", newline="") as f:
-        f.write(data)
+    if transcript_fn is None:
+        write_page(data, settings['source_mp3'], dest + ".html", render=render, template_fn=template_fn)
+        print(f"{dest} created!")
+        return
+
+    # Skip the render if nothing that goes into the page has changed
+    manifest = build_manifest.Manifest(os.path.dirname(os.path.abspath(dest)))
+    inputs = page_inputs(manifest, settings['source_mp3'], transcript_fn, render, template_fn)
+    if manifest.is_current(manifest.key(dest + ".html"), inputs):
+        print(f"{dest} is up to date")
+        return
+
+    other_files = write_page(
+        data, settings['source_mp3'], dest + ".html",
+        duration=manifest.mp3_duration(settings['source_mp3']), render=render, template_fn=template_fn,
+    )
+    manifest.record(manifest.key(dest + ".html"), inputs, [dest + ".html"] + other_files)
+    manifest.save()
     print(f"{dest} created!")
 
+def write_page(data, source_mp3, page_fn, **kwargs):
+    # Render a page to a temp file first, so a failure doesn't leave a partial
+    # page behind, and only remove the files the old page used once the new
+    # one is in place
+    temp_fn = page_fn + ".tmp"
+    with open(temp_fn, "wt", newline="") as f:
+        other_files = templater.fill_out(data, source_mp3, output=f, page_fn=page_fn, **kwargs)
+    os.replace(temp_fn, page_fn)
+    templater.remove_old_sidecars(page_fn, other_files)
+    return other_files
+
+def page_inputs(manifest, source_mp3, transcript_fn, render, template_fn):
+    # Everything that goes into rendering a page
+    return {
+        "transcript": manifest.file_hash(transcript_fn),
+        "template": manifest.file_hash(template_fn),
+        "mp3": manifest.file_stamp(source_mp3),
+        "render": render,
+        "generator": templater.GENERATOR_VERSION,
+    }
+
+def find_transcripts(target_dir):
+    # Find all of the saved transcripts with their audio next to them, the
+    # same layout create_webpage_and_data and transcribe_feed use
+    for dirpath, dirnames, filenames in os.walk(target_dir):
+        filenames = set(filenames)
+        for cur in sorted(filenames):
+            if cur.endswith(".json.gz") and cur[:-8] in filenames:
+                yield os.path.join(dirpath, cur[:-8])
+
+def rerender_one(job):
+    # Render the page for one transcript
+    source_mp3, duration, render, template_fn = job
+    # Read the transcript as it's rendered, long ones take a lot of memory to load
+    data = templater.StreamTranscript(source_mp3 + ".json.gz")
+    if duration is None:
+        with open(source_mp3, "rb") as f:
+            duration = mp3_splitter.ReadMP3.get_duration(f)
+    other_files = write_page(data, source_mp3, source_mp3 + ".html", duration=duration, render=render, template_fn=template_fn)
+    return source_mp3, duration, other_files
+
+@opt("Render the webpages again for all transcripts in a directory")
+def rerender(target_dir, processes=0, force=False, settings_file="", template_fn="template.html"):
+    # The only part of the settings file used is how to render the pages
+    render = None
+    if len(settings_file) > 0:
+        with open(settings_file, "rt", encoding="utf-8") as f:
+            render = json.load(f).get("render")
+    render = templater.get_render_options(render)
+
+    # Each directory of pages has its own manifest, the same one
+    # create_webpage uses
+    manifests = {}
+    todo = []
+    inputs = {}
+    skipped = 0
+    for source_mp3 in find_transcripts(target_dir):
+        dirname = os.path.dirname(os.path.abspath(source_mp3))
+        if dirname not in manifests:
+            manifests[dirname] = build_manifest.Manifest(dirname)
+            if render["assets"] == "external":
+                templater.write_player_assets(dirname, template_fn)
+        manifest = manifests[dirname]
+        inputs[source_mp3] = page_inputs(manifest, source_mp3, source_mp3 + ".json.gz", render, template_fn)
+        if not force and manifest.is_current(manifest.key(source_mp3 + ".html"), inputs[source_mp3]):
+            skipped += 1
+            continue
+        # Let the worker find the duration if it's not already known
+        todo.append((source_mp3, manifest.mp3_duration(source_mp3, compute=False), render, template_fn))
+
+    print(f"Rendering {len(todo):,} pages, skipping {skipped:,} unchanged...")
+    started = time.time()
+    next_msg = started + 5
+    try:
+        if len(todo) > 0:
+            # Each worker compiles the template once, on its first page
+            with multiprocessing.Pool(processes if processes > 0 else None) as pool:
+                for i, (source_mp3, duration, other_files) in enumerate(pool.imap_unordered(rerender_one, todo)):
+                    manifest = manifests[os.path.dirname(os.path.abspath(source_mp3))]
+                    manifest.set_mp3_duration(source_mp3, duration)
+                    manifest.record(manifest.key(source_mp3 + ".html"), inputs[source_mp3], [source_mp3 + ".html"] + other_files)
+                    if time.time() >= next_msg:
+                        print(f"Rendered {i+1:,} of {len(todo):,}, {(i+1) / (time.time() - started):.1f} pages/second...")
+                        next_msg += 5
+    finally:
+        # Save whatever was done, even if something failed
+        for manifest in manifests.values():
+            manifest.save()
+
+    took = time.time() - started
+    print(f"Done, rendered {len(todo):,} pages in {took:.2f} seconds, {len(todo) / max(took, 0.001):.1f} pages/second")
+
 if __name__ == "__main__":
     main_entry('func')
@@ -163,41 +163,74 @@ def process_feed(target_dir, settings):
     if stats['downloaded'] == 0:
         print("Nothing new to download")
 
+    # Only transcribe episodes without a transcript, pages for the rest are
+    # rendered again below if they're out of date
     todo = []
     for cur in cache.values():
-        web_page = os.path.join(target_dir, "media", cur['filename'] + ".html")
         meta_file = os.path.join(target_dir, "media", cur['filename'] + ".json.gz")
-        if not os.path.isfile(meta_file) or not os.path.isfile(web_page):
+        if not os.path.isfile(meta_file):
             todo.append(cur)
         else:
             stats['already_done'] += 1
     
+    # Optionally transcribe several episodes at once, useful for engines
+    # that do the work remotely
+    parallel = max(1, int(settings.get('parallel', 1)))
+    running = []
+
+    def wait_for_one():
+        proc, temp_fn = running.pop(0)
+        if proc.wait() != 0:
+            # Let the other episodes finish, so their work isn't lost, before
+            # stopping
+            while len(running) > 0:
+                wait_for_one()
+            raise subprocess.CalledProcessError(proc.returncode, proc.args)
+        stats['transcribed'] += 1
+
+        for fn in [temp_fn, temp_fn + ".gz"]:
+            if os.path.isfile(fn):
+                os.unlink(fn)
+
     for i, cur in enumerate(todo):
         if os.path.isfile('abort.txt'):
             print("Abort file detected!")
             break
 
-        web_page = os.path.join(target_dir, "media", cur['filename'] + ".html")
-        meta_file = os.path.join(target_dir, "media", cur['filename'] + ".json.gz")
-
-        temp_fn = "_temp_settings.json"
-        for fn in [temp_fn, temp_fn + ".gz"]:
-            if os.path.isfile(fn):
-                os.unlink(fn)
+        # Each episode has its own settings file, and the raw engine output
+        # is saved next to it, so a run that's stopped can pick up where it
+        # left off, as long as the settings are the same
+        temp_fn = f"_temp_settings_{cur['filename']}.json"
+        temp = DEFAULT_SETTINGS.copy()
+        temp['source_mp3'] = os.path.join(target_dir, "media", cur['filename'])
+        old = None
+        if os.path.isfile(temp_fn):
+            try:
+                with open(temp_fn, "rt") as f:
+                    old = json.load(f)
+            except ValueError:
+                pass
+        if old != temp and os.path.isfile(temp_fn + ".gz"):
+            os.unlink(temp_fn + ".gz")
 
         with open(temp_fn, "wt") as f:
-            temp = DEFAULT_SETTINGS.copy()
-            temp['source_mp3'] = os.path.join(target_dir, "media", cur['filename'])
             json.dump(temp, f)
 
         print("")
         print(f"Working on {i+1:,} of {len(todo):,}: '{cur['title']}'...")
-        subprocess.check_call(['python3', 'to_text.py', 'create_webpage_and_data', temp_fn])
-        stats['transcribed'] += 1
+        running.append((subprocess.Popen(['python3', 'to_text.py', 'create_webpage_and_data', temp_fn]), temp_fn))
+        while len(running) >= parallel:
+            wait_for_one()
 
-        for fn in [temp_fn, temp_fn + ".gz"]:
-            if os.path.isfile(fn):
-                os.unlink(fn)
+    while len(running) > 0:
+        wait_for_one()
+
+    # Render any pages that are missing or out of date
+    cmd = ['python3', 'to_text.py', 'rerender', target_dir]
+    if settings['engine'] is not None:
+        # Use the same render settings as the transcription
+        cmd += ['0', 'false', settings['engine']]
+    subprocess.check_call(cmd)
 
     print("")
     print(f"Done. Downloaded {stats['downloaded']:,}, transcribed {stats['transcribed']:,}, and {stats['already_done']:,} already done.")